@@ -0,0 +1,226 @@
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the approximate index; nprobe is the recall/latency knob
+ANN_ENABLED = os.environ.get('ANN_INDEX', '0') == '1'
+ANN_MIN_STUDENTS = int(os.environ.get('ANN_MIN_STUDENTS', 2000))
+ANN_COMPONENTS = int(os.environ.get('ANN_COMPONENTS', 128))
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+ANN_TOP_K = int(os.environ.get('ANN_TOP_K', 16))
+ANN_INDEX_PATH = os.environ.get('ANN_INDEX_PATH', 'face_index.npz')
+
+
+def _normalize_rows(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def _randomized_pca(x, n_components, rng, n_iter=2):
+    """Top principal axes of x via a randomized range finder (Halko et al.)"""
+    mean = x.mean(axis=0)
+    centered = x - mean
+    n_components = min(n_components, centered.shape[0], centered.shape[1])
+    sketch = centered @ rng.standard_normal((centered.shape[1], n_components + 10)).astype(np.float32)
+    for _ in range(n_iter):
+        sketch, _ = np.linalg.qr(sketch)
+        sketch = centered @ (centered.T @ sketch)
+    basis, _ = np.linalg.qr(sketch)
+    _, _, vt = np.linalg.svd(basis.T @ centered, full_matrices=False)
+    return mean.astype(np.float32), np.ascontiguousarray(vt[:n_components], dtype=np.float32)
+
+
+def _spherical_kmeans(x, n_clusters, rng, n_iter=10):
+    centroids = x[rng.choice(x.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        empty = ~sums.any(axis=1)
+        # Re-seed clusters that lost every member
+        sums[empty] = x[rng.choice(x.shape[0], int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over PCA-reduced face encodings.
+
+    Encodings are projected onto the top principal axes of the gallery and
+    bucketed by their nearest k-means centroid. A query scans only the
+    `nprobe` closest buckets and returns candidate row ids, which the
+    caller re-scores exactly against the full encodings.
+    """
+
+    def __init__(self, mean, components, centroids):
+        self.mean = mean
+        self.components = components
+        self.centroids = centroids
+        self.dim = components.shape[1]
+        self._reduced = np.empty((0, components.shape[0]), dtype=np.float32)
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._lists = [[] for _ in range(len(centroids))]
+        self._list_arrays = None
+        self.nprobe = ANN_NPROBE
+        self.top_k = ANN_TOP_K
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def build(cls, matrix, n_components=ANN_COMPONENTS, n_lists=None, sample_size=20000, seed=0):
+        """Fit PCA and the coarse quantizer on `matrix` and index all of its rows"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        rng = np.random.default_rng(seed)
+        sample = matrix
+        if matrix.shape[0] > sample_size:
+            sample = matrix[rng.choice(matrix.shape[0], sample_size, replace=False)]
+
+        mean, components = _randomized_pca(sample, n_components, rng)
+        reduced_sample = _normalize_rows((sample - mean) @ components.T)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(matrix.shape[0]))
+        n_lists = max(1, min(n_lists, reduced_sample.shape[0]))
+        centroids = _spherical_kmeans(reduced_sample, n_lists, rng)
+
+        index = cls(mean, components, centroids)
+        index.add(np.arange(matrix.shape[0]), matrix)
+        return index
+
+    def project(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        return _normalize_rows((vectors - self.mean) @ self.components.T)
+
+    def add(self, rows, vectors):
+        """Index (or re-index) gallery rows with the given full-size encodings"""
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if rows.size == 0:
+            return
+        reduced = self.project(vectors)
+        lists = np.argmax(reduced @ self.centroids.T, axis=1).astype(np.int32)
+
+        needed = int(rows.max()) + 1
+        if needed > self._reduced.shape[0]:
+            capacity = max(needed, 2 * self._reduced.shape[0], 64)
+            grown = np.empty((capacity, self._reduced.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._reduced[:self._size]
+            assignments = np.full(capacity, -1, dtype=np.int32)
+            assignments[:self._size] = self._assignments[:self._size]
+            self._reduced, self._assignments = grown, assignments
+
+        for row, vec, lst in zip(rows.tolist(), reduced, lists.tolist()):
+            previous = self._assignments[row] if row < self._size else -1
+            if previous >= 0:
+                self._lists[previous].remove(row)
+            self._reduced[row] = vec
+            self._assignments[row] = lst
+            self._lists[lst].append(row)
+        self._size = max(self._size, needed)
+        self._list_arrays = None
+
+    def search(self, probe, k=None, nprobe=None):
+        """Return up to k candidate row ids for a full-size probe encoding"""
+        k = k or self.top_k
+        nprobe = nprobe or self.nprobe
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64)
+        if self._list_arrays is None:
+            self._list_arrays = [np.asarray(members, dtype=np.int64) for members in self._lists]
+        query = self.project(probe)[0]
+
+        nprobe = min(nprobe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([self._list_arrays[i] for i in closest])
+        if candidates.size <= k:
+            return candidates
+        scores = self._reduced[candidates] @ query
+        return candidates[np.argpartition(-scores, k - 1)[:k]]
+
+    def save(self, path, rolls):
+        """Persist the index along with the roll of every indexed row"""
+        # Written beside the target and renamed over it, so a concurrent load never reads a torn file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                mean=self.mean,
+                components=self.components,
+                centroids=self.centroids,
+                reduced=self._reduced[:self._size],
+                assignments=self._assignments[:self._size],
+                rolls=np.asarray(rolls, dtype=str)
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save(); returns (index, rolls)"""
+        with np.load(path) as data:
+            index = cls(data['mean'], data['components'], data['centroids'])
+            index._reduced = data['reduced'].copy()
+            index._assignments = data['assignments'].copy()
+            index._size = len(index._assignments)
+            for row, lst in enumerate(index._assignments.tolist()):
+                index._lists[lst].append(row)
+            rolls = data['rolls'].tolist()
+        return index, rolls
+
+
+@contextmanager
+def _locked(path):
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_or_build(gallery, path=ANN_INDEX_PATH):
+    """Attach the saved index to the gallery, rebuilding it when it is stale"""
+    # One worker rebuilds a stale index while the others wait for it and load the result
+    with _locked(path):
+        index = _load_or_build(gallery, path)
+    gallery.attach_index(index)
+    return index
+
+
+def _load_or_build(gallery, path):
+    index = None
+    if os.path.exists(path):
+        try:
+            index, rolls = IVFIndex.load(path)
+            # Index rows are gallery template rows, saved with the roll owning each
+            if index.dim != gallery.dim or rolls != [str(roll) for roll in gallery.template_rolls()[:len(rolls)]]:
+                logger.warning("⚠️ ANN index is stale - rebuilding")
+                index = None
+            else:
+                # Index templates added since the file was written
+                index.add(np.arange(len(rolls), gallery.matrix.shape[0]), gallery.matrix[len(rolls):])
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load ANN index: {e}")
+            index = None
+
+    if index is None:
+        index = IVFIndex.build(gallery.matrix)
+        index.save(path, gallery.template_rolls())
+        logger.info(f"✅ ANN index built for {len(gallery)} students")
+    return index
+
+
+if __name__ == '__main__':
+    # Build the index from the configured students collection and save it
+    from app import get_face_gallery
+
+    gallery = get_face_gallery()
+    print(f"🔍 Building ANN index for {len(gallery)} students...")
+    index = IVFIndex.build(gallery.matrix)
+    index.save(ANN_INDEX_PATH, gallery.template_rolls())
+    print(f"✅ ANN index saved to {ANN_INDEX_PATH}")
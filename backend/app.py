@@ -1,652 +1,847 @@
-from flask import Flask, render_template, request, jsonify, send_file
+import time
+STARTED_AT = time.perf_counter()  # Cold-start clock, read before the imports below
+
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
-import cv2
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from pymongo.errors import DuplicateKeyError
 import numpy as np
+import logging
 import os
 from datetime import datetime, timedelta
 import base64
-import pickle
 import json
-import pandas as pd
-from io import BytesIO
+import itertools
+import threading
+import zipfile
+from gallery import FaceGallery
+from shared_gallery import SharedFaceGallery
+from live_session import LiveSession
+from attendance_writer import AttendanceWriter
+from references import ReferenceWriter
+from recognition_cache import RecognitionCache
+from storage import LazyStore, parse_timestamp
+import reports
+import enrollment
+import exports
+import ann_index
+from detection import DETECTION_RETRY_AFTER, DetectionPool, DetectorBusy, ROITracker, init_worker
+from embeddings import get_embedder
+from observability import (
+    DETECTOR_BUSY, MATCHES, NO_FACE, RECOGNITIONS, REGISTRATIONS, REQUEST_SECONDS, STAGE_SECONDS,
+    UNKNOWN_FACES, Gauge, configure_logging, registry
+)
+
+# LOG_LEVEL=DEBUG logs every step of each request; LOG_FORMAT=json for structured logs
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+sock = Sock(app)  # WebSocket routes for live recognition
 
 # Get environment variables
 MONGODB_URI = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/')
 DATABASE_NAME = os.environ.get('DATABASE_NAME', 'ai_attendance')
 PORT = int(os.environ.get('PORT', 5000))
 
-# MongoDB setup - make it optional for testing
-try:
-    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-    # Test the connection
-    client.admin.command('ping')
-    db = client[DATABASE_NAME]
-    students_col = db['students']
-    attendance_col = db['attendance']
-    print("✅ MongoDB connected successfully")
-except Exception as e:
-    print(f"⚠️ MongoDB connection failed: {e}")
-    print("📝 Will store data in local files for testing")
-    client = None
-    db = None
-    students_col = None
-    attendance_col = None
+# MongoDB connects on first use; local files stand in (for testing) while it is unreachable
+store = LazyStore(MONGODB_URI, DATABASE_NAME)
+
+# Load the face gallery at startup (in the gunicorn master with --preload) instead of on the first request
+PRELOAD_GALLERY = os.environ.get('PRELOAD_GALLERY', '1') == '1'
+
+# Attendance marks are buffered and written in bulk, at most once per student per day
+ATTENDANCE_FLUSH_INTERVAL = float(os.environ.get('ATTENDANCE_FLUSH_INTERVAL', 1.0))
+attendance_writer = AttendanceWriter(store, flush_interval=ATTENDANCE_FLUSH_INTERVAL)
 
 # Create uploads directory for storing reference images
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# Initialize OpenCV face detector
-try:
-    face_cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-    print(f"🔍 Loading face cascade from: {face_cascade_path}")
-    
-    if os.path.exists(face_cascade_path):
-        face_cascade = cv2.CascadeClassifier(face_cascade_path)
-        print("✅ Face cascade loaded successfully")
-    else:
-        print("❌ Face cascade file not found")
-        face_cascade = None
-except Exception as e:
-    print(f"❌ Error loading face cascade: {e}")
-    face_cascade = None
-
-def extract_face_features(image_path):
-    """Extract face features from an image"""
+# Face embeddings come from the configured backend (EMBEDDING_BACKEND); templates are tagged
+# with its model version so a model change never compares incompatible vectors
+embedder = get_embedder()
+
+# Face detection runs in a process pool; frames beyond the queue bound get a 503
+detector = DetectionPool()
+
+# Enrollment keeps up to this many face templates per student; matching uses the best one
+MAX_TEMPLATES = int(os.environ.get('MAX_TEMPLATES', 5))
+
+# A new face scoring above this against a registered student is rejected as a duplicate
+DUPLICATE_THRESHOLD = embedder.duplicate_threshold
+DUPLICATE_TOP_K = 5
+
+# Last face box per capture session, used as the search region for the next frame
+roi_tracker = ROITracker()
+
+# Recent results per capture session, reused for near-identical frames (RECOGNITION_CACHE_SIZE=0 disables)
+recognition_cache = RecognitionCache()
+
+# Live sessions: largest accepted frame and how long a silent connection stays open
+LIVE_MAX_FRAME_BYTES = int(os.environ.get('LIVE_MAX_FRAME_BYTES', 2 * 1024 * 1024))
+LIVE_IDLE_TIMEOUT = float(os.environ.get('LIVE_IDLE_TIMEOUT', 30))
+# Each live session holds a server thread for as long as it is open. Sessions beyond
+# LIVE_MAX_SESSIONS per worker are refused with close code 1013 (try again later), so the
+# rest of gunicorn's --threads stay free for HTTP requests.
+LIVE_MAX_SESSIONS = int(os.environ.get('LIVE_MAX_SESSIONS', 4))
+LIVE_TRY_AGAIN_LATER = 1013
+live_sessions = set()
+live_sessions_lock = threading.Lock()
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': LIVE_MAX_FRAME_BYTES}
+
+def detector_busy_response():
+    """503 telling the client to retry the frame shortly"""
+    DETECTOR_BUSY.inc()
+    response = jsonify({'success': False, 'error': 'Server is busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(DETECTION_RETRY_AFTER)
+    return response
+
+# Reference photos and face thumbnails are written by a background thread (0 writes them inline)
+ASYNC_REFERENCE_WRITES = os.environ.get('ASYNC_REFERENCE_WRITES', '1') == '1'
+reference_writer = ReferenceWriter(UPLOAD_FOLDER, background=ASYNC_REFERENCE_WRITES)
+
+def decode_image_data(image_data):
+    """Strip the data-URL prefix from a base64 image and return the raw bytes"""
+    if ',' in image_data:
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
+
+def write_reference_image(roll_number, image_bytes, box=None):
+    """Queue the kept reference image (and a thumbnail of the face in `box`) for writing"""
+    reference_writer.save(roll_number, image_bytes, box)
+
+# Gallery of normalized encodings, kept in sync with the student store. With GALLERY_SHARED_DIR
+# (e.g. /dev/shm/ai_attendance) all workers map one published copy instead of holding their own.
+GALLERY_SHARED_DIR = os.environ.get('GALLERY_SHARED_DIR', '')
+gallery_options = dict(
+    dim=embedder.dim, model=embedder.model_version,
+    center=embedder.center, threshold=embedder.match_threshold
+)
+if GALLERY_SHARED_DIR:
+    face_gallery = SharedFaceGallery(os.path.join(GALLERY_SHARED_DIR, DATABASE_NAME), **gallery_options)
+else:
+    face_gallery = FaceGallery(**gallery_options)
+
+registry.register(Gauge(
+    'attendance_detection_queue_depth', 'Detection tasks queued or running', lambda: detector.pending
+))
+registry.register(Gauge('attendance_gallery_students', 'Students in the face gallery', lambda: len(face_gallery)))
+registry.register(Gauge(
+    'attendance_reference_queue_depth', 'Reference images waiting to be written', lambda: reference_writer.pending
+))
+registry.register(Gauge('attendance_live_sessions', 'Open live WebSocket sessions', lambda: len(live_sessions)))
+
+def attach_ann_index():
+    """Put the optional ANN index in front of the gallery for large deployments"""
+    if not ann_index.ANN_ENABLED or len(face_gallery) < ann_index.ANN_MIN_STUDENTS:
+        return
     try:
-        print(f"🔍 Loading image: {image_path}")
-        
-        if face_cascade is None:
-            print("❌ Face cascade not loaded")
-            return None
-        
-        if not os.path.exists(image_path):
-            print(f"❌ Image file not found: {image_path}")
-            return None
-            
-        img = cv2.imread(image_path)
-        if img is None:
-            print(f"❌ Could not read image: {image_path}")
-            return None
-            
-        print(f"✅ Image loaded: {img.shape}")
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        print(f"✅ Converted to grayscale: {gray.shape}")
-        
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        print(f"🔍 Detected {len(faces)} faces")
-        
-        if len(faces) > 0:
-            (x, y, w, h) = faces[0]  # Take the first detected face
-            print(f"👤 Face found at: x={x}, y={y}, w={w}, h={h}")
-            
-            face_roi = gray[y:y+h, x:x+w]
-            # Resize to standard size for comparison
-            face_roi = cv2.resize(face_roi, (100, 100))
-            print(f"✅ Face ROI resized to: {face_roi.shape}")
-            
-            return face_roi.flatten()
-        else:
-            print("❌ No faces detected in image")
-            return None
-            
+        ann_index.load_or_build(face_gallery)
     except Exception as e:
-        print(f"💥 Error in extract_face_features: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
-
-def compare_faces(face1_features, face2_features, threshold=0.7):
-    """Compare two face feature vectors"""
-    if face1_features is None or face2_features is None:
-        return False
-    
-    # Convert to numpy arrays if they're lists
-    if isinstance(face1_features, list):
-        face1_features = np.array(face1_features)
-    if isinstance(face2_features, list):
-        face2_features = np.array(face2_features)
-    
-    # Calculate similarity using normalized correlation
-    correlation = np.corrcoef(face1_features, face2_features)[0, 1]
-    return correlation > threshold
+        logger.warning(f"⚠️ ANN index unavailable, using brute-force matching: {e}")
+
+def get_face_gallery():
+    """Return the face gallery, loading only students added since the last sync"""
+    if face_gallery.refresh():
+        # Another worker published a new version of the shared gallery
+        if face_gallery.ann is None:
+            attach_ann_index()
+    
+    if face_gallery.loaded and store.backend != face_gallery.source:
+        # Switched between local files and MongoDB: generation tokens are not comparable
+        face_gallery.invalidate()
+    
+    with STAGE_SECONDS.time('db_read'):
+        current = face_gallery.loaded and store.students_generation() == face_gallery.generation
+    if current:
+        return face_gallery
+    
+    if not face_gallery.loaded:
+        with STAGE_SECONDS.time('db_read'):
+            students, generation = store.gallery_students()
+            face_gallery.load(students, generation, source=store.backend)
+        logger.info(f"✅ Face gallery loaded: {len(face_gallery)} students")
+        attach_ann_index()
+    else:
+        with STAGE_SECONDS.time('db_read'):
+            changed, generation = store.students_since(face_gallery.generation)
+        face_gallery.update(changed, generation)
+        logger.info(f"🔄 Face gallery synced: {len(changed)} changed students")
+    return face_gallery
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_latency(response):
+    # WebSocket routes would report whole sessions, so only plain requests are timed
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    if rule and not rule.startswith('/ws/') and 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, rule)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Per-stage latency histograms and recognition counters in Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test', methods=['GET'])
 def test():
-    return jsonify({'status': 'Server is working!', 'message': 'API is accessible'})
+    return jsonify({
+        'status': 'Server is working!',
+        'message': 'API is accessible',
+        'startup': app.config.get('STARTUP_TIMINGS')
+    })
 
 @app.route('/test-register', methods=['POST'])
 def test_register():
     """Simple test endpoint for registration without face processing"""
     try:
-        print("🧪 Test registration endpoint called")
+        logger.debug("🧪 Test registration endpoint called")
         data = request.json
-        print(f"📝 Received data: {data}")
+        logger.debug(f"📝 Received data: {data}")
         return jsonify({'success': True, 'message': 'Test registration endpoint working', 'data': data})
     except Exception as e:
-        print(f"❌ Test registration error: {e}")
+        logger.error(f"❌ Test registration error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+def request_images(data):
+    """Frames sent as a single `image` and/or an `images` array (base64 data URLs)"""
+    images = list(data.get('images') or [])
+    if data.get('image'):
+        images.insert(0, data['image'])
+    return images
+
+def enrollment_templates(images):
+    """Detect the face in each enrollment frame; returns ((frame bytes, box), features) for frames with a face"""
+    frames = [decode_image_data(image_data) for image_data in images[:MAX_TEMPLATES]]
+    kept_frames, templates = [], []
+    for frame, (faces, _) in zip(frames, detector.detect_many(frames)):
+        if faces:
+            kept_frames.append((frame, faces[0][0]))
+            templates.append(faces[0][1])
+    return kept_frames, templates
+
+def register(data):
+    """Register a student from a /register body; returns the response payload (raises DetectorBusy)"""
+    if not data:
+        logger.warning("❌ No data received")
+        return {'success': False, 'error': 'No data received'}
+        
+    student_name = data.get('name')
+    roll_number = data.get('roll')
+    images = request_images(data)
+    
+    logger.debug(f"👤 Name: {student_name}")
+    logger.debug(f"🎫 Roll: {roll_number}")
+    logger.debug(f"📷 Frames: {len(images)}")
+    
+    if not all([student_name, roll_number, images]):
+        missing = []
+        if not student_name: missing.append('name')
+        if not roll_number: missing.append('roll')
+        if not images: missing.append('image')
+        logger.warning(f"❌ Missing fields: {missing}")
+        return {'success': False, 'error': f'Missing required fields: {missing}'}
+    
+    # Check if student is already registered
+    logger.debug(f"🔍 Checking if roll number {roll_number} already exists...")
+    with STAGE_SECONDS.time('db_read'):
+        registered = store.find_student(roll_number)
+    if registered:
+        logger.warning(f"❌ Student {roll_number} already registered")
+        return {'success': False, 'error': f'Student with roll number {roll_number} is already registered!'}
+    
+    logger.debug(f"✅ Roll number {roll_number} is available")
+    
+    # Check if image_data has proper format
+    if any(',' not in image_data for image_data in images):
+        logger.warning("❌ Invalid image format - no comma separator")
+        return {'success': False, 'error': 'Invalid image format'}
+    
+    # Check if this face is already registered with a different roll number
+    logger.debug(f"🔍 Checking if this face is already registered...")
+    try:
+        frames, templates = enrollment_templates(images)
+        if not templates:
+            return {'success': False, 'error': 'No face detected in the image'}
+    except DetectorBusy:
+        raise
+    except Exception as img_error:
+        logger.error(f"❌ Image decode error: {img_error}")
+        return {'success': False, 'error': f'Failed to process image: {str(img_error)}'}
+    
+    # Score the new face against every registered student in one vectorized pass
+    closest = get_face_gallery().top_matches(np.vstack(templates), k=DUPLICATE_TOP_K)
+    if closest and closest[0][2] > DUPLICATE_THRESHOLD:
+        roll, name, score = closest[0]
+        logger.warning(f"❌ Face already registered with roll {roll} (score {score:.3f})")
+        return {
+            'success': False,
+            'error': f'This face is already registered with roll number {roll} ({name})',
+            'candidates': [{'roll': r, 'name': n, 'score': round(s, 4)} for r, n, s in closest]
+        }
+    
+    logger.debug(f"✅ Face is unique - proceeding with registration")
+    
+    face_features = np.vstack(templates)
+    
+    student_data = {
+        'roll': roll_number,
+        'name': student_name,
+        'registered_at': datetime.now().isoformat() + 'Z'
+    }
+    
+    logger.debug(f"💾 Storing to database...")
+    try:
+        with STAGE_SECONDS.time('db_write'):
+            store.add_student(student_data, face_features, model=embedder.model_version)
+        logger.debug("✅ Student stored")
+    except DuplicateKeyError:
+        # Another request registered the same roll number first
+        return {'success': False, 'error': f'Student with roll number {roll_number} is already registered!'}
+    except Exception as db_error:
+        logger.error(f"❌ Storage error: {db_error}")
+        return {'success': False, 'error': f'Database error: {str(db_error)}'}
+    
+    # Append to this worker's gallery; other workers pick it up via the generation check
+    face_gallery.add(roll_number, student_name, face_features)
+    
+    # The reference photo and face thumbnail are written off the request thread
+    write_reference_image(roll_number, *frames[0])
+    
+    REGISTRATIONS.inc()
+    logger.info(f"🎉 Registration completed successfully with {len(templates)} templates")
+    return {'success': True, 'message': 'Student registered successfully', 'templates': len(templates)}
+
 @app.route('/register', methods=['POST'])
 def register_student():
     """Register a new student with face image"""
     try:
-        print("=== Registration request received ===")
+        logger.debug("=== Registration request received ===")
         
         # Check if request has JSON data
         if not request.is_json:
-            print("❌ Request is not JSON")
+            logger.warning("❌ Request is not JSON")
             return jsonify({'success': False, 'error': 'Request must be JSON'})
         
-        data = request.json
-        print(f"📝 Received data keys: {list(data.keys()) if data else 'None'}")
-        
-        if not data:
-            print("❌ No data received")
-            return jsonify({'success': False, 'error': 'No data received'})
-            
-        student_name = data.get('name')
-        roll_number = data.get('roll')
-        image_data = data.get('image')
-        
-        print(f"👤 Name: {student_name}")
-        print(f"🎫 Roll: {roll_number}")
-        print(f"📷 Image data length: {len(image_data) if image_data else 0}")
-        
-        if not all([student_name, roll_number, image_data]):
-            missing = []
-            if not student_name: missing.append('name')
-            if not roll_number: missing.append('roll')
-            if not image_data: missing.append('image')
-            print(f"❌ Missing fields: {missing}")
-            return jsonify({'success': False, 'error': f'Missing required fields: {missing}'})
-        
-        # Check if student is already registered
-        print(f"🔍 Checking if roll number {roll_number} already exists...")
-        if students_col is not None:
-            existing_student = students_col.find_one({'roll': roll_number})
-            if existing_student:
-                print(f"❌ Student {roll_number} already registered")
-                return jsonify({'success': False, 'error': f'Student with roll number {roll_number} is already registered!'})
-        else:
-            # Check local file for duplicates
-            local_db_path = 'local_students.json'
-            if os.path.exists(local_db_path):
-                with open(local_db_path, 'r') as f:
-                    students = json.load(f)
-                    for student in students:
-                        if student.get('roll') == roll_number:
-                            print(f"❌ Student {roll_number} already registered (local)")
-                            return jsonify({'success': False, 'error': f'Student with roll number {roll_number} is already registered!'})
-        
-        print(f"✅ Roll number {roll_number} is available")
-        
-        # Check if this face is already registered with a different roll number
-        print(f"🔍 Checking if this face is already registered...")
-        captured_features = None
-        
-        # Save temp image first to extract features for comparison
-        temp_image_path = os.path.join(UPLOAD_FOLDER, f"temp_{roll_number}.jpg")
-        try:
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-            with open(temp_image_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            captured_features = extract_face_features(temp_image_path)
-            if captured_features is None:
-                os.remove(temp_image_path) if os.path.exists(temp_image_path) else None
-                return jsonify({'success': False, 'error': 'No face detected in the image'})
-        except Exception as img_error:
-            print(f"❌ Temp image error: {img_error}")
-            return jsonify({'success': False, 'error': f'Failed to process image: {str(img_error)}'})
-        
-        # Check against existing faces
-        if students_col is not None:
-            existing_students = list(students_col.find())
-        else:
-            local_db_path = 'local_students.json'
-            existing_students = []
-            if os.path.exists(local_db_path):
-                with open(local_db_path, 'r') as f:
-                    existing_students = json.load(f)
-        
-        for existing_student in existing_students:
-            try:
-                if 'encodings' in existing_student and existing_student['encodings']:
-                    stored_encodings = existing_student['encodings'][0]  # Get first encoding
-                    
-                    # Compare faces
-                    if compare_faces(captured_features, stored_encodings, threshold=0.8):  # High threshold for registration
-                        os.remove(temp_image_path) if os.path.exists(temp_image_path) else None
-                        print(f"❌ Face already registered with roll {existing_student['roll']}")
-                        return jsonify({
-                            'success': False, 
-                            'error': f'This face is already registered with roll number {existing_student["roll"]} ({existing_student["name"]})'
-                        })
-            except Exception as e:
-                print(f"⚠️ Error comparing with student {existing_student.get('roll', 'unknown')}: {e}")
-                continue
-        
-        print(f"✅ Face is unique - proceeding with registration")
-        
-        # Clean up temp file and proceed with normal registration
-        os.remove(temp_image_path) if os.path.exists(temp_image_path) else None
-        
-        # Check if image_data has proper format
-        if ',' not in image_data:
-            print("❌ Invalid image format - no comma separator")
-            return jsonify({'success': False, 'error': 'Invalid image format'})
-        
-        # Save the reference image
-        image_path = os.path.join(UPLOAD_FOLDER, f"{roll_number}.jpg")
-        print(f"💾 Saving image to: {image_path}")
-        
-        try:
-            # Decode base64 image and save
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-            with open(image_path, 'wb') as f:
-                f.write(image_bytes)
-            print(f"✅ Image saved successfully ({len(image_bytes)} bytes)")
-        except Exception as img_error:
-            print(f"❌ Image save error: {img_error}")
-            return jsonify({'success': False, 'error': f'Failed to save image: {str(img_error)}'})
-        
-        # Extract face features and save them as encodings
-        print("🔍 Extracting face features for storage...")
-        try:
-            # We already extracted features for comparison, now save the image properly
-            image_path = os.path.join(UPLOAD_FOLDER, f"{roll_number}.jpg")
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-            with open(image_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            # Use the already extracted features
-            face_features = captured_features
-            print(f"✅ Face features ready: {len(face_features)} features")
-        except Exception as face_error:
-            print(f"❌ Face storage error: {face_error}")
-            return jsonify({'success': False, 'error': f'Face processing failed: {str(face_error)}'})
-        
-        # Convert numpy array to list for JSON storage
-        encodings = [face_features.tolist()]
-        print(f"📊 Encodings prepared: {len(encodings[0])} values")
-        
-        # Store student info in MongoDB with your specified format
-        student_data = {
-            'roll': roll_number,
-            'name': student_name,
-            'encodings': encodings,
-            'registered_at': datetime.now().isoformat() + 'Z'
-        }
-        
-        print(f"💾 Storing to database...")
-        
-        # Store in MongoDB if available, otherwise store locally
-        if students_col is not None:
-            try:
-                students_col.insert_one(student_data)
-                print("✅ Stored in MongoDB")
-            except Exception as db_error:
-                print(f"❌ MongoDB error: {db_error}")
-                return jsonify({'success': False, 'error': f'Database error: {str(db_error)}'})
-        else:
-            try:
-                # Store in local JSON file as fallback
-                local_db_path = 'local_students.json'
-                students = []
-                
-                if os.path.exists(local_db_path):
-                    with open(local_db_path, 'r') as f:
-                        students = json.load(f)
-                
-                students.append(student_data)
-                
-                with open(local_db_path, 'w') as f:
-                    json.dump(students, f, indent=2)
-                
-                print("✅ Stored in local file")
-            except Exception as file_error:
-                print(f"❌ File storage error: {file_error}")
-                return jsonify({'success': False, 'error': f'Storage error: {str(file_error)}'})
-        
-        print("🎉 Registration completed successfully")
-        return jsonify({'success': True, 'message': 'Student registered successfully'})
+        return jsonify(register(request.json))
         
+    except DetectorBusy:
+        return detector_busy_response()
     except Exception as e:
-        print(f"💥 Unexpected error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"💥 Unexpected error: {str(e)}")
         return jsonify({'success': False, 'error': f'Server error: {str(e)}'})
 
+@app.route('/register/bulk', methods=['POST'])
+def register_bulk():
+    """Register students from an uploaded ZIP of {roll}.jpg photos (plus optional students.csv)"""
+    try:
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'success': False, 'error': 'Upload a ZIP file in the "file" field'})
+        
+        result = enrollment.bulk_enroll(
+            upload.stream, store, get_face_gallery(), detector,
+            save_image=write_reference_image, threshold=DUPLICATE_THRESHOLD
+        )
+        return jsonify(dict(result, success=True, message=f"{len(result['enrolled'])} students registered"))
+    
+    except zipfile.BadZipFile:
+        return jsonify({'success': False, 'error': 'File is not a ZIP archive'})
+    except DetectorBusy:
+        return detector_busy_response()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/enroll/<roll>', methods=['POST'])
+def enroll_frames(roll):
+    """Add face templates to an already registered student from more frames"""
+    try:
+        data = request.json or {}
+        images = request_images(data)
+        if not images:
+            return jsonify({'success': False, 'error': 'Missing required field: image or images'})
+        
+        with STAGE_SECONDS.time('db_read'):
+            student = store.find_student(roll)
+        if not student:
+            return jsonify({'success': False, 'error': f'Student with roll number {roll} is not registered'})
+        
+        _, templates = enrollment_templates(images)
+        if not templates:
+            return jsonify({'success': False, 'error': 'No face detected in the images'})
+        
+        # Refuse frames that look more like someone else than a plausible new view of this student
+        gallery = get_face_gallery()
+        accepted, rejected = [], 0
+        for features in templates:
+            match = gallery.best_match(features, threshold=DUPLICATE_THRESHOLD)
+            if match is not None and match[0] != roll:
+                logger.warning(f"❌ Enrollment frame for {roll} matches {match[0]}")
+                rejected += 1
+            else:
+                accepted.append(features)
+        if not accepted:
+            return jsonify({'success': False, 'error': 'These frames match a different registered student'})
+        
+        with STAGE_SECONDS.time('db_write'):
+            count = store.add_encodings(roll, np.vstack(accepted), MAX_TEMPLATES, model=embedder.model_version)
+        if count is None:
+            return jsonify({'success': False, 'error': f'Student with roll number {roll} is not registered'})
+        
+        # Refresh this worker's copy of the student's templates with the stored stack
+        with STAGE_SECONDS.time('db_read'):
+            stored = next(store.iter_students(with_encodings=True, roll=roll), None)
+        if stored is not None:
+            face_gallery.add(roll, student['name'], stored['encodings'])
+        
+        logger.info(f"✅ Enrolled {len(accepted)} more templates for {roll} ({count} stored)")
+        return jsonify({
+            'success': True,
+            'added': len(accepted),
+            'rejected': rejected,
+            'templates': count,
+            'message': f'{len(accepted)} face templates added'
+        })
+    
+    except DetectorBusy:
+        return detector_busy_response()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def registration_status(roll_number):
+    """Response payload telling whether `roll_number` is registered"""
+    if not roll_number:
+        return {'success': False, 'error': 'Roll number is required'}
+    
+    # Check if student exists
+    with STAGE_SECONDS.time('db_read'):
+        existing_student = store.find_student(roll_number)
+    if existing_student:
+        return {
+            'success': True, 
+            'exists': True, 
+            'student': {
+                'name': existing_student['name'],
+                'roll': existing_student['roll'],
+                'registered_at': existing_student['registered_at']
+            }
+        }
+    
+    return {'success': True, 'exists': False}
+
 @app.route('/check-registration', methods=['POST'])
 def check_registration():
     """Check if a student is already registered"""
     try:
-        data = request.json
-        roll_number = data.get('roll')
-        
-        if not roll_number:
-            return jsonify({'success': False, 'error': 'Roll number is required'})
-        
-        # Check if student exists
-        if students_col is not None:
-            existing_student = students_col.find_one({'roll': roll_number})
-            if existing_student:
-                return jsonify({
-                    'success': True, 
-                    'exists': True, 
-                    'student': {
-                        'name': existing_student['name'],
-                        'roll': existing_student['roll'],
-                        'registered_at': existing_student['registered_at']
-                    }
-                })
-        else:
-            # Check local file
-            local_db_path = 'local_students.json'
-            if os.path.exists(local_db_path):
-                with open(local_db_path, 'r') as f:
-                    students = json.load(f)
-                    for student in students:
-                        if student.get('roll') == roll_number:
-                            return jsonify({
-                                'success': True, 
-                                'exists': True, 
-                                'student': {
-                                    'name': student['name'],
-                                    'roll': student['roll'],
-                                    'registered_at': student['registered_at']
-                                }
-                            })
-        
-        return jsonify({'success': True, 'exists': False})
+        return jsonify(registration_status(request.json.get('roll')))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def recognize_frame(session, image_bytes):
+    """Recognize the face in one frame and mark attendance; returns the response payload (raises DetectorBusy)"""
+    hint = roi_tracker.get(session)
+    
+    # A session's near-identical repeat frames reuse the last result: no detection, no matching
+    start = time.perf_counter()
+    frame = recognition_cache.frame(session, image_bytes)
+    cached = recognition_cache.get(session, frame, hint)
+    if cached is not None:
+        box, match = cached
+        timings = {'cache_ms': round((time.perf_counter() - start) * 1000, 2)}
+    else:
+        # Detection and feature extraction run in the detection pool; frames from a
+        # capture session search around the face found in the previous frame first
+        start = time.perf_counter()
+        box, captured_features, timings = detector.detect_first(image_bytes, hint)
+        timings['detection_total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        match = None
+        if captured_features is not None:
+            # Score against every registered student in one pass and keep the best match
+            start = time.perf_counter()
+            match = get_face_gallery().best_match(captured_features)
+            STAGE_SECONDS.observe(time.perf_counter() - start, 'match')
+            timings['match_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            recognition_cache.put(session, frame, box, match)
+    roi_tracker.update(session, box)
+    RECOGNITIONS.inc()
+    if box is None:
+        NO_FACE.inc()
+        return {'success': False, 'message': 'No face detected in captured image', 'timings': timings}
+    
+    recognized_student = None
+    (MATCHES if match is not None else UNKNOWN_FACES).inc()
+    if match is not None:
+        roll, name, score = match
+        recognized_student = {'roll': roll, 'name': name}
+        logger.debug(f"✅ Best match {roll} (score {score:.3f})")
+    
+    if recognized_student:
+        # Mark attendance
+        newly_marked = attendance_writer.mark(recognized_student['roll'], recognized_student['name'])
+        
+        return {
+            'success': True, 
+            'student_name': recognized_student['name'],
+            'roll': recognized_student['roll'],  # Changed from student_id to roll
+            'already_marked': not newly_marked,
+            'message': 'Attendance marked successfully' if newly_marked else 'Attendance already marked today',
+            'timings': timings
+        }
+    else:
+        return {'success': False, 'message': 'Student not recognized', 'timings': timings}
+
 @app.route('/recognize', methods=['POST'])
 def recognize_face():
     """Recognize face and mark attendance"""
     try:
         data = request.json
         image_data = data.get('image')  # Base64 encoded image
-        
-        # Save captured image temporarily
-        temp_image_path = 'temp_capture.jpg'
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        with open(temp_image_path, 'wb') as f:
-            f.write(image_bytes)
-        
-        # Extract features from captured image
-        captured_features = extract_face_features(temp_image_path)
-        if captured_features is None:
-            return jsonify({'success': False, 'message': 'No face detected in captured image'})
-        
-        # Get all registered students
-        if students_col is not None:
-            students = list(students_col.find())
-            print(f"Found {len(students)} students in MongoDB")
-        else:
-            # Load from local file
-            local_db_path = 'local_students.json'
-            if os.path.exists(local_db_path):
-                with open(local_db_path, 'r') as f:
-                    students = json.load(f)
-                print(f"Found {len(students)} students in local file")
-            else:
-                students = []
-                print("No students found - database empty")
-        
-        recognized_student = None
-        for student in students:
-            try:
-                # Get stored encodings (first encoding from the array)
-                stored_encodings = student['encodings'][0]  # Get first encoding
-                
-                # Compare faces using OpenCV
-                if compare_faces(captured_features, stored_encodings):
-                    recognized_student = student
-                    break
-                    
-            except Exception as e:
-                continue  # Skip if encodings not found or corrupted
-        
-        # Clean up temp file
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        
-        if recognized_student:
-            # Mark attendance
-            attendance_data = {
-                'roll': recognized_student['roll'],  # Changed from student_id to roll
-                'name': recognized_student['name'],
-                'timestamp': datetime.now().isoformat() + 'Z',  # ISO format
-                'status': 'present'
-            }
-            
-            # Store attendance
-            if attendance_col is not None:
-                attendance_col.insert_one(attendance_data)
-                print("✅ Attendance stored in MongoDB")
-            else:
-                # Store in local file
-                local_attendance_path = 'local_attendance.json'
-                attendance_records = []
-                
-                if os.path.exists(local_attendance_path):
-                    with open(local_attendance_path, 'r') as f:
-                        attendance_records = json.load(f)
-                
-                attendance_records.append(attendance_data)
-                
-                with open(local_attendance_path, 'w') as f:
-                    json.dump(attendance_records, f, indent=2)
-                
-                print("✅ Attendance stored in local file")
-            
-            return jsonify({
-                'success': True, 
-                'student_name': recognized_student['name'],
-                'roll': recognized_student['roll'],  # Changed from student_id to roll
-                'message': 'Attendance marked successfully'
-            })
-        else:
-            return jsonify({'success': False, 'message': 'Student not recognized'})
+        session = data.get('session')  # Optional id shared by frames from one camera
+        return jsonify(recognize_frame(session, decode_image_data(image_data)))
             
+    except DetectorBusy:
+        return detector_busy_response()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/recognize/batch', methods=['POST'])
+def recognize_batch():
+    """Recognize every face in a classroom photo or a list of frames and mark attendance"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'success': False, 'error': 'No data received'})
+        
+        # Accept a single classroom photo, an array of frames, or both
+        frames = request_images(data)
+        if not frames:
+            return jsonify({'success': False, 'error': 'Missing required field: image or images'})
+        
+        # Detect every face in every frame first (frames in parallel across the
+        # detection pool) so matching runs as one vectorized pass
+        start = time.perf_counter()
+        detections = detector.detect_many([decode_image_data(frame_data) for frame_data in frames])
+        timings = {
+            'detection_total_ms': round((time.perf_counter() - start) * 1000, 2),
+            'frames': [frame_timings for _, frame_timings in detections]
+        }
+        RECOGNITIONS.inc(len(frames))
+        NO_FACE.inc(sum(1 for faces, _ in detections if not faces))
+        boxes, frame_ids, features = [], [], []
+        for frame_id, (faces, _) in enumerate(detections):
+            for box, face_features in faces:
+                boxes.append(box)
+                frame_ids.append(frame_id)
+                features.append(face_features)
+        
+        if not features:
+            return jsonify({'success': False, 'message': 'No faces detected', 'faces': [], 'timings': timings})
+        
+        start = time.perf_counter()
+        matches = get_face_gallery().best_matches(np.vstack(features))
+        STAGE_SECONDS.observe(time.perf_counter() - start, 'match')
+        timings['match_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        recognized = sum(1 for match in matches if match is not None)
+        MATCHES.inc(recognized)
+        UNKNOWN_FACES.inc(len(matches) - recognized)
+        
+        results, marked, already_marked = [], [], []
+        for frame_id, box, match in zip(frame_ids, boxes, matches):
+            result = {'frame': frame_id, 'box': list(box), 'recognized': match is not None}
+            if match is not None:
+                roll, name, score = match
+                result.update({'roll': roll, 'student_name': name, 'score': round(score, 4)})
+                # The same student can appear in several frames; the writer marks them once
+                if attendance_writer.mark(roll, name):
+                    marked.append(roll)
+                elif roll not in already_marked and roll not in marked:
+                    already_marked.append(roll)
+            results.append(result)
+        
+        # Write the whole batch in one bulk operation
+        attendance_writer.flush()
+        
+        return jsonify({
+            'success': True,
+            'faces': results,
+            'marked': marked,
+            'already_marked': already_marked,
+            'message': f'Attendance marked for {len(marked)} students',
+            'timings': timings
+        })
+    
+    except DetectorBusy:
+        return detector_busy_response()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def process_live_frame(session, frame):
+    """Recognize the newest frame of a live session; returns the events to push back"""
+    try:
+        box, features, timings = detector.detect_first(frame, session.box)
+    except DetectorBusy:
+        session.drop()
+        return []
+    session.box = box
+    
+    event = {'type': 'frame', 'box': list(box) if box else None, 'recognized': False, 'timings': timings}
+    events = [event]
+    RECOGNITIONS.inc()
+    match = None
+    if features is None:
+        NO_FACE.inc()
+    else:
+        with STAGE_SECONDS.time('match'):
+            match = get_face_gallery().best_match(features)
+        (MATCHES if match is not None else UNKNOWN_FACES).inc()
+    if match is not None:
+        roll, name, score = match
+        event.update({'recognized': True, 'roll': roll, 'student_name': name, 'score': round(score, 4)})
+        # Report each student once per session; the writer marks them once per day
+        if roll not in session.seen:
+            session.seen.add(roll)
+            newly_marked = attendance_writer.mark(roll, name)
+            events.append({
+                'type': 'marked' if newly_marked else 'already_marked',
+                'roll': roll,
+                'student_name': name,
+                'time': datetime.now().strftime('%H:%M:%S')
+            })
+    event['stats'] = session.stats()
+    return events
+
+@sock.route('/ws/recognize')
+def live_recognition(ws):
+    """Live attendance over a WebSocket: binary JPEG frames in, JSON recognition events out"""
+    with live_sessions_lock:
+        full = len(live_sessions) >= LIVE_MAX_SESSIONS
+        if not full:
+            session = LiveSession(process_live_frame, lambda event: ws.send(json.dumps(event)))
+            live_sessions.add(session.id)
+    if full:
+        logger.warning(f"❌ Live session refused: {LIVE_MAX_SESSIONS} already open")
+        ws.close(reason=LIVE_TRY_AGAIN_LATER, message='Too many live sessions, try again later')
+        return
+    
+    logger.info(f"🎥 Live session {session.id} started")
+    try:
+        ws.send(json.dumps({'type': 'ready', 'session': session.id}))
+        while True:
+            message = ws.receive(timeout=LIVE_IDLE_TIMEOUT)
+            if message is None:
+                break  # Idle for too long
+            if isinstance(message, bytes):
+                session.push(message)
+    except ConnectionClosed:
+        pass
+    finally:
+        session.close()
+        with live_sessions_lock:
+            live_sessions.discard(session.id)
+        logger.info(f"🎥 Live session {session.id} ended: {session.stats()}")
+
 @app.route('/attendance_report')
 def attendance_report():
-    """Get attendance report for today"""
+    """Get the attendance report for a day (?date=YYYY-MM-DD, default today)"""
     try:
-        today = datetime.now().strftime('%Y-%m-%d')
+        day = datetime.strptime(request.args['date'], '%Y-%m-%d') if 'date' in request.args else datetime.now()
+        return jsonify(dict(reports.daily_report(store, day), success=True))
         
-        # Get today's attendance records
-        attendance_records = list(attendance_col.find({
-            'timestamp': {
-                '$gte': datetime.strptime(today, '%Y-%m-%d'),
-                '$lt': datetime.strptime(today, '%Y-%m-%d') + timedelta(days=1)
-            }
-        }))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/attendance_report/monthly')
+def monthly_attendance_report():
+    """Get per-day and per-student attendance for a month (?month=YYYY-MM, default this month)"""
+    try:
+        month = datetime.strptime(request.args['month'], '%Y-%m') if 'month' in request.args else datetime.now()
+        return jsonify(dict(reports.monthly_report(store, month.year, month.month), success=True))
         
-        return jsonify({'success': True, 'records': attendance_records})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/attendance_report/student/<roll>')
+def student_attendance_report(roll):
+    """Get one student's attendance % between ?start= and ?end= (default: last 30 days)"""
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') if 'end' in request.args else datetime.now() + timedelta(days=1)
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if 'start' in request.args else end - timedelta(days=30)
+        return jsonify(dict(reports.student_report(store, roll, start, end), success=True))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def export_filters(args):
+    """Read ?start=YYYY-MM-DD&end=YYYY-MM-DD&roll= export filters (end date inclusive)"""
+    start = datetime.strptime(args['start'], '%Y-%m-%d') if args.get('start') else None
+    end = datetime.strptime(args['end'], '%Y-%m-%d') + timedelta(days=1) if args.get('end') else None
+    return start, end, args.get('roll') or None
+
+def check_export_format(format):
+    """Raise ValueError unless `format` is one the exports support"""
+    if format.lower() not in ('excel', 'csv'):
+        raise ValueError('Invalid format. Use "excel" or "csv"')
+
+def students_export(format, roll=None):
+    """(file name, sheet name, header, rows) of a students export; raises ValueError for nothing to export"""
+    check_export_format(format)
+    
+    # Stream students sorted by roll, without their encodings
+    students = iter(store.iter_students(roll=roll))
+    first = next(students, None)
+    if first is None:
+        raise ValueError('No student data to export')
+    
+    rows = (
+        [student.get('roll', ''), student.get('name', ''), student.get('registered_at', ''), student.get('encoding_dim', 0)]
+        for student in itertools.chain([first], students)
+    )
+    return (
+        f'students_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}',
+        'Students',
+        ['Roll Number', 'Name', 'Registration Date', 'Encodings Count'],
+        rows
+    )
+
 @app.route('/export/students/<format>')
 def export_students(format):
-    """Export students data to Excel or CSV"""
+    """Export students data to Excel or CSV (?roll= to export one student)"""
     try:
-        print(f"📊 Exporting students data to {format.upper()}")
-        
-        # Get all students data
-        if students_col is not None:
-            students = list(students_col.find({}, {'_id': 0}))  # Exclude MongoDB _id field
-            print(f"Found {len(students)} students in MongoDB")
-        else:
-            # Load from local file
-            local_db_path = 'local_students.json'
-            if os.path.exists(local_db_path):
-                with open(local_db_path, 'r') as f:
-                    students = json.load(f)
-                print(f"Found {len(students)} students in local file")
-            else:
-                students = []
-                print("No students found")
-        
-        if not students:
-            return jsonify({'success': False, 'error': 'No student data to export'})
-        
-        # Prepare data for export (exclude encodings for readability)
-        export_data = []
-        for student in students:
-            export_data.append({
-                'Roll Number': student.get('roll', ''),
-                'Name': student.get('name', ''),
-                'Registration Date': student.get('registered_at', ''),
-                'Encodings Count': len(student.get('encodings', [[]])[0]) if student.get('encodings') else 0
-            })
-        
-        # Create DataFrame
-        df = pd.DataFrame(export_data)
-        
-        if format.lower() == 'excel':
-            # Export to Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Students', index=False)
-            output.seek(0)
-            
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f'students_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        
-        elif format.lower() == 'csv':
-            # Export to CSV
-            output = BytesIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f'students_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-                mimetype='text/csv'
-            )
-        
-        else:
-            return jsonify({'success': False, 'error': 'Invalid format. Use "excel" or "csv"'})
+        logger.info(f"📊 Exporting students data to {format.upper()}")
+        return exports.export_response(format, *students_export(format, request.args.get('roll') or None))
     
     except Exception as e:
-        print(f"❌ Export error: {e}")
+        logger.error(f"❌ Export error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+def attendance_rows(records):
+    """Turn attendance records into Roll Number/Name/Date/Time/Status rows"""
+    for record in records:
+        # Parse timestamp (native date or legacy ISO string)
+        timestamp = record.get('timestamp', '')
+        dt = parse_timestamp(timestamp)
+        if dt is not None:
+            date = dt.strftime('%Y-%m-%d')
+            time = dt.strftime('%H:%M:%S')
+        else:
+            date = str(timestamp)
+            time = ''
+        yield [record.get('roll', ''), record.get('name', ''), date, time, record.get('status', 'present').title()]
+
+def attendance_export(format, args):
+    """(file name, sheet name, header, rows) of an attendance export filtered by `args`"""
+    check_export_format(format)
+    
+    # Stream matching records newest first, sorted by the database
+    start, end, roll = export_filters(args)
+    records = iter(store.iter_attendance(start, end, roll, newest_first=True))
+    first = next(records, None)
+    if first is None:
+        raise ValueError('No attendance data to export')
+    
+    return (
+        f'attendance_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}',
+        'Attendance',
+        ['Roll Number', 'Name', 'Date', 'Time', 'Status'],
+        attendance_rows(itertools.chain([first], records))
+    )
+
 @app.route('/export/attendance/<format>')
 def export_attendance(format):
-    """Export attendance data to Excel or CSV"""
+    """Export attendance data to Excel or CSV (?start=, ?end= and ?roll= narrow the export)"""
     try:
-        print(f"📊 Exporting attendance data to {format.upper()}")
-        
-        # Get all attendance data
-        if attendance_col is not None:
-            attendance_records = list(attendance_col.find({}, {'_id': 0}))  # Exclude MongoDB _id field
-            print(f"Found {len(attendance_records)} attendance records in MongoDB")
-        else:
-            # Load from local file
-            local_attendance_path = 'local_attendance.json'
-            if os.path.exists(local_attendance_path):
-                with open(local_attendance_path, 'r') as f:
-                    attendance_records = json.load(f)
-                print(f"Found {len(attendance_records)} attendance records in local file")
-            else:
-                attendance_records = []
-                print("No attendance records found")
-        
-        if not attendance_records:
-            return jsonify({'success': False, 'error': 'No attendance data to export'})
-        
-        # Prepare data for export
-        export_data = []
-        for record in attendance_records:
-            # Parse timestamp
-            timestamp = record.get('timestamp', '')
-            if timestamp:
-                try:
-                    # Convert ISO format to readable format
-                    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    date = dt.strftime('%Y-%m-%d')
-                    time = dt.strftime('%H:%M:%S')
-                except:
-                    date = timestamp
-                    time = ''
-            else:
-                date = ''
-                time = ''
-            
-            export_data.append({
-                'Roll Number': record.get('roll', ''),
-                'Name': record.get('name', ''),
-                'Date': date,
-                'Time': time,
-                'Status': record.get('status', 'present').title()
-            })
-        
-        # Create DataFrame
-        df = pd.DataFrame(export_data)
-        
-        # Sort by date and time
-        df = df.sort_values(['Date', 'Time'], ascending=[False, False])
-        
-        if format.lower() == 'excel':
-            # Export to Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Attendance', index=False)
-            output.seek(0)
-            
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f'attendance_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        logger.info(f"📊 Exporting attendance data to {format.upper()}")
+        return exports.export_response(format, *attendance_export(format, request.args))
+    
+    except Exception as e:
+        logger.error(f"❌ Export error: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/export/daily-report/<date>/<format>')
+def export_daily_report(date, format):
+    """Export every student's present/absent status for one day to Excel or CSV"""
+    try:
+        logger.info(f"📊 Exporting daily report for {date} to {format.upper()}")
+        check_export_format(format)
         
-        elif format.lower() == 'csv':
-            # Export to CSV
-            output = BytesIO()
-            df.to_csv(output, index=False)
-            output.seek(0)
-            
-            return send_file(
-                output,
-                as_attachment=True,
-                download_name=f'attendance_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-                mimetype='text/csv'
-            )
+        report = reports.daily_report(store, datetime.strptime(date, '%Y-%m-%d'))
+        if not report['total_students'] and not report['records']:
+            return jsonify({'success': False, 'error': 'No student data to export'})
         
-        else:
-            return jsonify({'success': False, 'error': 'Invalid format. Use "excel" or "csv"'})
+        def rows():
+            present = {record['roll']: record for record in report['records']}
+            for student in store.iter_students():
+                record = present.pop(student['roll'], None)
+                yield [
+                    student['roll'],
+                    student.get('name', ''),
+                    report['date'],
+                    record['time'] if record else '',
+                    'Present' if record else 'Absent'
+                ]
+            # Marks for students who have since been removed
+            for record in present.values():
+                yield [record['roll'], record['name'], report['date'], record['time'], 'Present']
+        
+        return exports.export_response(
+            format,
+            f'daily_report_{report["date"]}',
+            'Daily Report',
+            ['Roll Number', 'Name', 'Date', 'Time', 'Status'],
+            rows()
+        )
     
     except Exception as e:
-        print(f"❌ Export error: {e}")
+        logger.error(f"❌ Export error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
 # ...existing code for registration, recognition, attendance marking...
 
+def create_app():
+    """Warm up what every worker needs and return the app.
+
+    With `gunicorn --preload 'app:create_app()'` this runs once in the master:
+    the face gallery (and, for inline detection, the cascade and embedding
+    model) is loaded there and the forked workers share it copy-on-write. The database connection is
+    closed again before the fork and each worker reconnects on first use.
+    """
+    if 'STARTUP_TIMINGS' in app.config:
+        return app
+    
+    timings = {'imports_ms': round((time.perf_counter() - STARTED_AT) * 1000, 2)}
+    if detector.workers <= 0:
+        # Inline detection: load the models here (pool workers load their own)
+        start = time.perf_counter()
+        init_worker()
+        timings['models_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    
+    if PRELOAD_GALLERY:
+        start = time.perf_counter()
+        try:
+            get_face_gallery()
+        except Exception as e:
+            logger.warning(f"⚠️ Face gallery not preloaded, loading on first request: {e}")
+            face_gallery.invalidate()
+        timings['gallery_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        store.disconnect()
+    
+    timings['total_ms'] = round((time.perf_counter() - STARTED_AT) * 1000, 2)
+    app.config['STARTUP_TIMINGS'] = timings
+    logger.info(f"🚀 Cold start in {timings['total_ms']} ms: {timings}")
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=PORT)
+    create_app().run(debug=False, host='0.0.0.0', port=PORT)
@@ -0,0 +1,154 @@
+"""ASGI variant of the API, for one process serving many camera clients at once.
+
+    uvicorn --app-dir backend asgi:app --host 0.0.0.0 --port $PORT
+
+/register, /recognize, /check-registration and the student and attendance
+exports run the Flask app's own handlers (`register`, `recognize_frame`,
+...) on Starlette's thread pool and stream exports from it, so the event
+loop only parses requests and writes responses. Every other route, the web
+UI included, is the Flask app mounted behind these. The live WebSocket
+(/ws/recognize) needs the gunicorn deployment.
+"""
+import functools
+import logging
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as wsgi
+import exports
+from detection import DETECTION_RETRY_AFTER, DetectorBusy
+from observability import DETECTOR_BUSY, REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Preload the gallery and start the detection pool as the Flask app would
+flask_app = wsgi.create_app()
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def error(message):
+    return JSONResponse({'success': False, 'error': message})
+
+
+def detector_busy_response():
+    """503 telling the client to retry the frame shortly"""
+    DETECTOR_BUSY.inc()
+    return JSONResponse(
+        {'success': False, 'error': 'Server is busy, please retry'},
+        status_code=503, headers={'Retry-After': str(DETECTION_RETRY_AFTER)}
+    )
+
+
+def timed(rule):
+    """Record the handler's latency under the same endpoint label as the Flask route"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            with REQUEST_SECONDS.time(rule):
+                return await handler(request)
+        return wrapper
+    return decorator
+
+
+@timed('/register')
+async def register_student(request):
+    """Register a new student with face image"""
+    try:
+        if request.headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+            return error('Request must be JSON')
+        return JSONResponse(await run_in_threadpool(wsgi.register, await request.json()))
+
+    except DetectorBusy:
+        return detector_busy_response()
+    except Exception as e:
+        logger.exception(f"💥 Unexpected error: {str(e)}")
+        return error(f'Server error: {str(e)}')
+
+
+@timed('/check-registration')
+async def check_registration(request):
+    """Check if a student is already registered"""
+    try:
+        data = await request.json()
+        return JSONResponse(await run_in_threadpool(wsgi.registration_status, data.get('roll')))
+
+    except Exception as e:
+        return error(str(e))
+
+
+@timed('/recognize')
+async def recognize_face(request):
+    """Recognize face and mark attendance"""
+    try:
+        data = await request.json()
+        image_bytes = wsgi.decode_image_data(data.get('image'))
+        return JSONResponse(await run_in_threadpool(wsgi.recognize_frame, data.get('session'), image_bytes))
+
+    except DetectorBusy:
+        return detector_busy_response()
+    except Exception as e:
+        return error(str(e))
+
+
+def file_chunks(output):
+    """Read a temp file out in chunks and close (deleting) it afterwards"""
+    try:
+        yield from iter(lambda: output.read(FILE_CHUNK_SIZE), b'')
+    finally:
+        output.close()
+
+
+async def export_response(format, basename, sheet_name, header, rows):
+    """Stream the CSV or Excel download; rows are read on the thread pool, not the event loop"""
+    if format.lower() == 'excel':
+        output = await run_in_threadpool(exports.xlsx_file, sheet_name, header, rows)
+        filename, chunks, media_type = f'{basename}.xlsx', file_chunks(output), exports.XLSX_MIMETYPE
+    else:
+        filename, chunks, media_type = f'{basename}.csv', exports.csv_chunks(header, rows), 'text/csv'
+    return StreamingResponse(
+        chunks, media_type=media_type, headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@timed('/export/students/<format>')
+async def export_students(request):
+    """Export students data to Excel or CSV (?roll= to export one student)"""
+    format = request.path_params['format']
+    try:
+        table = await run_in_threadpool(wsgi.students_export, format, request.query_params.get('roll') or None)
+        return await export_response(format, *table)
+
+    except Exception as e:
+        logger.error(f"❌ Export error: {e}")
+        return error(str(e))
+
+
+@timed('/export/attendance/<format>')
+async def export_attendance(request):
+    """Export attendance data to Excel or CSV (?start=, ?end= and ?roll= narrow the export)"""
+    format = request.path_params['format']
+    try:
+        table = await run_in_threadpool(wsgi.attendance_export, format, request.query_params)
+        return await export_response(format, *table)
+
+    except Exception as e:
+        logger.error(f"❌ Export error: {e}")
+        return error(str(e))
+
+
+app = Starlette(routes=[
+    Route('/register', register_student, methods=['POST']),
+    Route('/check-registration', check_registration, methods=['POST']),
+    Route('/recognize', recognize_face, methods=['POST']),
+    Route('/export/students/{format}', export_students),
+    Route('/export/attendance/{format}', export_attendance),
+    # Everything else is served by the Flask app
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
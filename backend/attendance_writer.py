@@ -0,0 +1,94 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+from observability import MARKED, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceWriter:
+    """Buffers attendance marks and flushes them in bulk, once per student per day.
+
+    An in-memory set of (roll, date) pairs drops repeat marks before they
+    reach storage. Pending marks are flushed every `flush_interval` seconds
+    by a background thread (or immediately when the interval is 0) as
+    upserts keyed on (roll, date), which the store enforces across gunicorn
+    workers.
+    """
+
+    def __init__(self, store, flush_interval=1.0):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._marked = set()
+        self._marked_date = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        # Started on first use, so a writer created before gunicorn forks still gets a thread per worker
+        if self.flush_interval > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, daemon=True, name='attendance-writer')
+            self._thread.start()
+
+    def mark(self, roll, name, when=None):
+        """Queue a present mark; returns False if the student is already marked today"""
+        when = when or datetime.now()
+        date = when.strftime('%Y-%m-%d')
+        with self._lock:
+            if date != self._marked_date:
+                self._marked = self._load_marked(date)
+                self._marked_date = date
+            if roll in self._marked:
+                return False
+            self._marked.add(roll)
+            self._ensure_thread()
+            MARKED.inc()
+            self._pending.append({
+                'roll': roll,
+                'name': name,
+                'date': date,
+                'timestamp': when,  # Native date in Mongo, ISO string in local files
+                'status': 'present'
+            })
+
+        if self.flush_interval <= 0:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write all pending marks to storage in one bulk operation"""
+        with self._flush_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records:
+                return 0
+            try:
+                with STAGE_SECONDS.time('db_write'):
+                    stored = self.store.upsert_attendance(records)
+                logger.debug(f"✅ {stored} attendance records stored")
+            except Exception as e:
+                logger.error(f"❌ Attendance flush failed, will retry: {e}")
+                with self._lock:
+                    self._pending = records + self._pending
+                return 0
+            return len(records)
+
+    def _load_marked(self, date):
+        """Seed the already-marked set from storage when the day changes"""
+        try:
+            with STAGE_SECONDS.time('db_read'):
+                return self.store.attendance_rolls(date)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load today's attendance: {e}")
+            return set()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
@@ -0,0 +1,256 @@
+"""Benchmark the register, recognize and export routes end to end.
+
+Runs offline through Flask's test client against a throwaway local-file
+store (or mongomock with --store mongomock, which needs a mongomock release
+that supports the installed pymongo's bulk writes) at several gallery sizes:
+
+    python benchmark.py --sizes 100 1000 10000 100000 --output run.json
+
+Students are seeded synthetic face crops with face-like low-rank structure.
+Requests send those crops JPEG-encoded and upscaled, and a full-frame
+stand-in replaces the Haar cascade (which finds no faces in synthetic
+crops), so `detect` covers the detection plumbing, not the cascade itself.
+Use `python detection.py photo.jpg` for cascade timings on real photos.
+Each size reports p50/p99 latency and throughput per route as JSON; the
+same seed gives the same data, so runs can be diffed. The pixel gallery
+holds 40 KB of float32 per student: 100k students need about 4 GB of RAM.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Inline detection (the stand-in cascade lives in this process) and quiet logs on stdout
+os.environ.setdefault('DETECTION_WORKERS', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('PRELOAD_GALLERY', '0')
+
+import base64
+
+import cv2
+import numpy as np
+
+CROP_SIZE = 100
+LATENT_DIM = 64
+
+
+class FullFrameCascade:
+    """Stands in for the Haar cascade: every frame is one face"""
+
+    def detectMultiScale(self, image, scaleFactor=1.1, minNeighbors=3, minSize=None, maxSize=None):
+        height, width = image.shape[:2]
+        return np.array([[0, 0, width, height]])
+
+
+class SyntheticFaces:
+    """Reproducible 100x100 grayscale crops: a mean face plus a low-rank per-student offset"""
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        # Smooth basis images, so crops survive JPEG and resizing like real faces do
+        coarse = rng.standard_normal((LATENT_DIM, 12, 12)).astype(np.float32)
+        self.basis = np.stack([cv2.resize(b, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_CUBIC) for b in coarse])
+        self.mean_face = cv2.resize(
+            rng.uniform(70, 180, (6, 6)).astype(np.float32), (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_CUBIC
+        )
+
+    def crops(self, start, count):
+        """Crops of students start..start+count (the same ones for the same seed)"""
+        latent = np.stack([np.random.default_rng([self.seed, i]).standard_normal(LATENT_DIM) for i in range(start, start + count)])
+        faces = self.mean_face + 12 * np.tensordot(latent.astype(np.float32), self.basis, axes=1)
+        return np.clip(faces, 0, 255).astype(np.uint8)
+
+    def frame(self, index, attempt=0, scale=2):
+        """A JPEG frame of one student as a camera would send it: upscaled, with sensor noise"""
+        crop = cv2.resize(self.crops(index, 1)[0], (CROP_SIZE * scale, CROP_SIZE * scale))
+        noise = np.random.default_rng([self.seed, index, attempt, 1]).normal(0, 3, crop.shape)
+        image = np.clip(crop + noise, 0, 255).astype(np.uint8)
+        return cv2.imencode('.jpg', cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))[1].tobytes()
+
+
+def data_url(image_bytes):
+    return 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode()
+
+
+def summarize(latencies, wall_seconds, ok):
+    latencies = np.asarray(latencies)
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        'mean_ms': round(float(latencies.mean()) * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 2)
+    }
+
+
+def run_requests(app, calls, concurrency):
+    """Issue `calls` (each: client -> success) and time every one; returns the route summary"""
+    def timed(call):
+        client = app.test_client()
+        start = time.perf_counter()
+        ok = call(client)
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(timed, calls))
+    else:
+        results = [timed(call) for call in calls]
+    wall_seconds = time.perf_counter() - start
+    return summarize([seconds for seconds, _ in results], wall_seconds, sum(ok for _, ok in results))
+
+
+def make_store(kind, directory):
+    from storage import LocalStore, MongoStore
+    if kind == 'mongomock':
+        import mongomock
+        store = MongoStore(mongomock.MongoClient()['benchmark'])
+        store.ensure_indexes()
+        return store
+    return LocalStore(directory)
+
+
+def populate(app_module, faces, size, batch_size=1000):
+    """Register `size` students straight into the store with one day of attendance"""
+    from detection import get_embedder
+
+    embedder = get_embedder()
+    store = app_module.store
+    # Yesterday, so recognize requests still mark attendance today
+    day = app_module.datetime.now() - app_module.timedelta(days=1)
+    date = day.strftime('%Y-%m-%d')
+    for start in range(0, size, batch_size):
+        crops = faces.crops(start, min(batch_size, size - start))
+        encodings = embedder.embed([(crop, (0, 0, CROP_SIZE, CROP_SIZE)) for crop in crops])
+        for offset, encoding in enumerate(encodings):
+            roll = f'S{start + offset:06d}'
+            store.add_student(
+                {'roll': roll, 'name': f'Student {start + offset}', 'registered_at': day.isoformat() + 'Z'},
+                encoding, model=embedder.model_version
+            )
+        store.upsert_attendance([
+            {'roll': f'S{start + offset:06d}', 'name': f'Student {start + offset}', 'date': date,
+             'timestamp': day, 'status': 'present'}
+            for offset in range(len(crops))
+        ])
+
+
+def benchmark_size(app_module, faces, size, args):
+    directory = tempfile.mkdtemp(prefix=f'benchmark-{size}-')
+    os.chdir(directory)
+    os.makedirs(app_module.UPLOAD_FOLDER, exist_ok=True)
+    app_module.store.use(make_store(args.store, directory))
+    app_module.attendance_writer = app_module.AttendanceWriter(app_module.store, flush_interval=0)
+    app_module.face_gallery.invalidate()
+
+    start = time.perf_counter()
+    populate(app_module, faces, size)
+    populate_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    app_module.get_face_gallery()
+    gallery_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng([args.seed, size])
+    app = app_module.app
+    routes = {}
+
+    def recognize(index, attempt):
+        def call(client):
+            result = client.post('/recognize', json={'image': data_url(faces.frame(index, attempt))}).json
+            # One face answers with its roll; several come back under `faces`
+            rolls = [result.get('roll')] + [face.get('roll') for face in result.get('faces') or []]
+            return f'S{index:06d}' in rolls
+        return call
+
+    # Known students, so every request goes through matching and attendance marking;
+    # `ok` counts the ones matched to the right student
+    probes = rng.integers(0, size, args.requests).tolist()
+    routes['recognize'] = run_requests(app, [recognize(i, n) for n, i in enumerate(probes)], args.concurrency)
+
+    # New students, past the end of the gallery
+    routes['register'] = run_requests(app, [
+        lambda client, i=i: client.post('/register', json={
+            'roll': f'N{i:06d}', 'name': f'New {i}', 'image': data_url(faces.frame(i))
+        }).json.get('success', False)
+        for i in range(size, size + args.requests)
+    ], args.concurrency)
+
+    def export(url):
+        def call(client):
+            response = client.get(url)
+            body = response.get_data()  # Drain streamed responses
+            return response.status_code == 200 and response.mimetype != 'application/json' and len(body) > 0
+        return call
+
+    for name, url in [
+        ('export_students_csv', '/export/students/csv'),
+        ('export_students_xlsx', '/export/students/excel'),
+        ('export_attendance_csv', '/export/attendance/csv'),
+        ('export_attendance_xlsx', '/export/attendance/excel'),
+    ]:
+        routes[name] = run_requests(app, [export(url)] * args.export_runs, 1)
+    # Reference photos are written in the background, relative to this size's directory
+    app_module.reference_writer.flush()
+
+    return {
+        'gallery_size': size,
+        'populate_seconds': round(populate_seconds, 2),
+        'gallery_load_seconds': round(gallery_seconds, 3),
+        'routes': routes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=200, help='recognize and register requests per size')
+    parser.add_argument('--export-runs', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--store', choices=['local', 'mongomock'], default='local')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    os.chdir(workdir)  # app creates its uploads folder in the working directory
+    import detection
+    detection.face_cascade = FullFrameCascade()
+    import app as app_module
+
+    faces = SyntheticFaces(args.seed)
+    results = {
+        'config': {
+            'sizes': args.sizes,
+            'requests': args.requests,
+            'export_runs': args.export_runs,
+            'concurrency': args.concurrency,
+            'store': args.store,
+            'seed': args.seed,
+            'embedding_model': app_module.embedder.model_version,
+            'detector': 'full-frame stand-in',
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'cpus': os.cpu_count()
+        },
+        'results': [benchmark_size(app_module, faces, size, args) for size in args.sizes]
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Measure ANN recall@1 and latency against brute-force gallery matching.
+
+Runs offline on a synthetic gallery with face-like low-rank structure:
+
+    python benchmark_ann.py --students 100000 --nprobe 4 8 16 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from gallery import FEATURE_DIM, FaceGallery
+
+
+def synthetic_encodings(n_students, n_queries, noise, seed=0):
+    """Gallery encodings plus noisy probes of randomly chosen students"""
+    rng = np.random.default_rng(seed)
+    # Faces vary along far fewer directions than there are pixels
+    basis = rng.standard_normal((64, FEATURE_DIM)).astype(np.float32)
+    mean_face = rng.uniform(60, 190, FEATURE_DIM).astype(np.float32)
+    latent = rng.standard_normal((n_students, 64)).astype(np.float32)
+    gallery = mean_face + 4 * (latent @ basis)
+    truth = rng.choice(n_students, n_queries, replace=False)
+    probes = gallery[truth] + rng.normal(0, noise, (n_queries, FEATURE_DIM)).astype(np.float32)
+    return gallery, probes
+
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=40.0)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--top-k', type=int, default=16)
+    args = parser.parse_args()
+
+    encodings, probes = synthetic_encodings(args.students, args.queries, args.noise)
+    gallery = FaceGallery()
+    gallery.load({'roll': str(i), 'name': str(i), 'encodings': [row]} for i, row in enumerate(encodings))
+    del encodings
+
+    # Brute force is the ground truth
+    exact, exact_times = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        scores, _, _ = gallery.scores(probe)
+        exact.append(int(np.argmax(scores)))
+        exact_times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery.matrix)
+    build_seconds = time.perf_counter() - start
+
+    results = {
+        'students': args.students,
+        'queries': args.queries,
+        'build_seconds': round(build_seconds, 2),
+        'brute_force': {'p50_ms': percentile_ms(exact_times, 50), 'p99_ms': percentile_ms(exact_times, 99)},
+        'ann': []
+    }
+    gallery.attach_index(index)
+    index.top_k = args.top_k
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        hits, times = 0, []
+        for probe, expected in zip(probes, exact):
+            start = time.perf_counter()
+            match = gallery.best_match(probe, threshold=-1)
+            times.append(time.perf_counter() - start)
+            hits += match is not None and match[0] == str(expected)
+        results['ann'].append({
+            'nprobe': nprobe,
+            'recall_at_1': round(hits / len(probes), 4),
+            'p50_ms': percentile_ms(times, 50),
+            'p99_ms': percentile_ms(times, 99)
+        })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from embeddings import get_embedder
+from observability import STAGE_SECONDS, configure_logging, observe_timings
+
+logger = logging.getLogger(__name__)
+
+# Detection runs in a pool of processes shared by all request threads of an HTTP worker.
+# DETECTION_WORKERS=0 runs detection inline on the request thread instead.
+DETECTION_WORKERS = int(os.environ.get('DETECTION_WORKERS', os.cpu_count() or 1))
+DETECTION_QUEUE_SIZE = int(os.environ.get('DETECTION_QUEUE_SIZE', 4 * max(DETECTION_WORKERS, 1)))
+DETECTION_TIMEOUT = float(os.environ.get('DETECTION_TIMEOUT', 10))
+DETECTION_RETRY_AFTER = int(os.environ.get('DETECTION_RETRY_AFTER', 1))
+
+# Detection runs on a frame downscaled towards DETECTION_MAX_WIDTH pixels wide (0 keeps
+# full resolution); boxes are mapped back and faces embedded from the full-resolution frame.
+# Face size bounds are in full-resolution pixels (DETECTION_MAX_FACE=0 means unbounded).
+# Faces smaller than DETECTION_MIN_FACE are never found.
+DETECTION_MAX_WIDTH = int(os.environ.get('DETECTION_MAX_WIDTH', 320))
+DETECTION_SCALE_FACTOR = float(os.environ.get('DETECTION_SCALE_FACTOR', 1.3))
+DETECTION_MIN_NEIGHBORS = int(os.environ.get('DETECTION_MIN_NEIGHBORS', 5))
+DETECTION_MIN_FACE = int(os.environ.get('DETECTION_MIN_FACE', 48))
+DETECTION_MAX_FACE = int(os.environ.get('DETECTION_MAX_FACE', 0))
+
+# Continuous capture reuses the last face box, grown by ROI_MARGIN of its size on each side,
+# as the search region for the next frame if it is at most ROI_TTL seconds old
+ROI_MARGIN = float(os.environ.get('DETECTION_ROI_MARGIN', 0.5))
+ROI_TTL = float(os.environ.get('DETECTION_ROI_TTL', 2.0))
+ROI_MAX_SESSIONS = int(os.environ.get('DETECTION_ROI_SESSIONS', 1000))
+
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+# The cascade's fixed search window: a face smaller than this in the scanned image is missed
+CASCADE_WINDOW = 24
+
+# Loaded once per process: in the app for inline detection, in each pool worker otherwise
+face_cascade = None
+
+
+class DetectorBusy(Exception):
+    """Raised when the detection queue is full or a frame times out"""
+
+
+def load_cascade():
+    """Load the Haar face cascade for this process, or None if it is unavailable"""
+    global face_cascade
+    if face_cascade is not None:
+        return face_cascade
+    try:
+        logger.info(f"🔍 Loading face cascade from: {CASCADE_PATH}")
+        if os.path.exists(CASCADE_PATH):
+            face_cascade = cv2.CascadeClassifier(CASCADE_PATH)
+            logger.info("✅ Face cascade loaded successfully")
+        else:
+            logger.error("❌ Face cascade file not found")
+    except Exception as e:
+        logger.error(f"❌ Error loading face cascade: {e}")
+    return face_cascade
+
+
+def decode_image(image_bytes, grayscale=False):
+    """Decode encoded image bytes straight into an OpenCV array, or None"""
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+
+
+def load_grayscale(image):
+    """Return a grayscale array from an image array (BGR or grayscale) or image path"""
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            logger.warning(f"❌ Image file not found: {image}")
+            return None
+        image = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+
+    if image is None:
+        logger.warning("❌ Could not read image")
+        return None
+
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _detect_boxes(gray, min_face=DETECTION_MIN_FACE, max_face=DETECTION_MAX_FACE):
+    """Run the cascade on a downscaled copy of `gray`; boxes are in `gray` coordinates"""
+    scale = 1.0
+    small = gray
+    if DETECTION_MAX_WIDTH and gray.shape[1] > DETECTION_MAX_WIDTH:
+        # Stop shrinking before a `min_face` face gets smaller than the cascade's window
+        scale = min(max(DETECTION_MAX_WIDTH / gray.shape[1], CASCADE_WINDOW / min_face), 1.0)
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    min_size = max(int(min_face * scale), 1)
+    max_size = int(max_face * scale) if max_face else 0
+    boxes = face_cascade.detectMultiScale(
+        small, DETECTION_SCALE_FACTOR, DETECTION_MIN_NEIGHBORS,
+        minSize=(min_size, min_size), maxSize=(max_size, max_size)
+    )
+
+    height, width = gray.shape[:2]
+    mapped = []
+    for box in boxes:
+        x, y, w, h = (int(round(v / scale)) for v in box)
+        x, y = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+        mapped.append((x, y, min(w, width - x), min(h, height - y)))
+    return mapped
+
+
+def _search_roi(gray, hint):
+    """Look for a face only around the previous frame's box; boxes are in frame coordinates"""
+    x, y, w, h = hint
+    margin_x, margin_y = int(w * ROI_MARGIN), int(h * ROI_MARGIN)
+    left, top = max(x - margin_x, 0), max(y - margin_y, 0)
+    right = min(x + w + margin_x, gray.shape[1])
+    bottom = min(y + h + margin_y, gray.shape[0])
+    if right <= left or bottom <= top:
+        return []
+
+    # Between consecutive frames a face moves a little and changes size a little
+    size = min(w, h)
+    max_face = max(w, h) * 2
+    if DETECTION_MAX_FACE:
+        max_face = min(max_face, DETECTION_MAX_FACE)
+    boxes = _detect_boxes(gray[top:bottom, left:right], max(size // 2, DETECTION_MIN_FACE), max_face)
+    return [(bx + left, by + top, bw, bh) for (bx, by, bw, bh) in boxes]
+
+
+def _locate_faces(image, hint):
+    """Find face boxes in one image; returns (grayscale image, boxes, timings)"""
+    timings = {}
+    try:
+        if load_cascade() is None:
+            logger.error("❌ Face cascade not loaded")
+            return None, [], timings
+
+        gray = load_grayscale(image)
+        if gray is None:
+            return None, [], timings
+
+        start = time.perf_counter()
+        boxes = _search_roi(gray, hint) if hint else []
+        if hint:
+            timings['roi'] = 'hit' if boxes else 'miss'
+            timings['roi_ms'] = _elapsed_ms(start)
+        if not boxes:
+            start = time.perf_counter()
+            boxes = _detect_boxes(gray)
+            timings['detect_ms'] = _elapsed_ms(start)
+        logger.debug(f"🔍 Detected {len(boxes)} faces")
+        return gray, boxes, timings
+
+    except Exception as e:
+        logger.exception(f"💥 Error in detect_faces: {e}")
+        return None, [], timings
+
+
+def detect_images(images, hints=None):
+    """Detect and embed every face in several images (arrays or paths).
+
+    Returns one ([((x, y, w, h), features), ...], timings) per image. The
+    faces of all images are embedded in a single batch. Timings hold
+    per-stage milliseconds and, when a `hint` box from the previous frame
+    was given, whether searching around it found a face ('hit') or a full
+    scan was needed ('miss').
+    """
+    embedder = get_embedder()
+    hints = hints or [None] * len(images)
+    located, crops = [], []
+    for image, hint in zip(images, hints):
+        if embedder.color and isinstance(image, str):
+            image = cv2.imread(image)
+        gray, boxes, timings = _locate_faces(image, hint)
+        # Color models embed from the decoded color frame, the pixel model from grayscale
+        source = image if embedder.color and isinstance(image, np.ndarray) and image.ndim == 3 else gray
+        located.append((boxes, timings))
+        crops.extend((source, box) for box in boxes)
+
+    features = []
+    if crops:
+        start = time.perf_counter()
+        try:
+            features = embedder.embed(crops)
+        except Exception as e:
+            logger.exception(f"💥 Error embedding faces: {e}")
+            return [([], timings) for _, timings in located]
+        embed_ms = _elapsed_ms(start)
+
+    results, offset = [], 0
+    for boxes, timings in located:
+        if boxes:
+            timings['embed_ms'] = embed_ms
+        results.append((list(zip(boxes, features[offset:offset + len(boxes)])), timings))
+        offset += len(boxes)
+    return results
+
+
+def detect_faces(image, hint=None):
+    """Detect and embed every face in one image; returns (faces, timings)"""
+    return detect_images([image], [hint])[0]
+
+
+def detect_encoded_frames(frames, hints):
+    """Pool task: decode encoded frames and detect their faces; returns (faces, timings) per frame"""
+    grayscale = not get_embedder().color
+    images, decode_times = [], []
+    for image_bytes in frames:
+        start = time.perf_counter()
+        images.append(decode_image(image_bytes, grayscale=grayscale))
+        decode_times.append(_elapsed_ms(start))
+    results = detect_images(images, hints)
+    for (_, timings), decode_ms in zip(results, decode_times):
+        timings['decode_ms'] = decode_ms
+    return results
+
+
+def detect_encoded(image_bytes, hint=None):
+    """Decode one encoded frame and detect its faces; returns (faces, timings)"""
+    return detect_encoded_frames([image_bytes], [hint])[0]
+
+
+def init_worker():
+    """Pool initializer: load the cascade and the embedding model once per worker"""
+    configure_logging()
+    load_cascade()
+    get_embedder().load()
+
+
+class ROITracker:
+    """Last face box seen per capture session, so the next frame can search around it"""
+
+    def __init__(self, ttl=ROI_TTL, max_sessions=ROI_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._boxes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session):
+        """The session's last box if it is recent enough to search around, else None"""
+        if not session:
+            return None
+        with self._lock:
+            entry = self._boxes.get(session)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def update(self, session, box):
+        """Remember the box found in the session's latest frame (None forgets it)"""
+        if not session:
+            return
+        with self._lock:
+            self._boxes.pop(session, None)
+            if box is not None:
+                self._boxes[session] = (tuple(box), time.monotonic())
+                while len(self._boxes) > self.max_sessions:
+                    self._boxes.popitem(last=False)
+
+
+class DetectionPool:
+    """Process pool for face detection with a bounded number of queued frames.
+
+    Frames are sent encoded (a few KB of JPEG rather than a decoded array) and
+    decoded in the worker. At most `queue_size` frames may be waiting or running
+    at once (a multi-frame request is split into at most `workers` tasks, each
+    taking one slot); beyond that `submit` raises DetectorBusy so the caller can
+    shed load with a 503 instead of piling up requests. The pool is started lazily so each
+    gunicorn worker creates its own after forking.
+    """
+
+    def __init__(self, workers=DETECTION_WORKERS, queue_size=DETECTION_QUEUE_SIZE, timeout=DETECTION_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(queue_size, workers, 1))
+        self.pending = 0  # Tasks queued or running, for /metrics
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Forking a threaded server is unsafe; start workers from a clean interpreter
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                if context.get_start_method() == 'forkserver':
+                    # Each worker forks from a server that has already imported OpenCV and NumPy
+                    context.set_forkserver_preload(['detection'])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=init_worker
+                )
+                logger.info(f"✅ Detection pool started with {self.workers} workers")
+            return self._executor
+
+    def submit(self, frames, hints=None):
+        """Queue encoded frames as one detection task; raises DetectorBusy if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise DetectorBusy('Face detection queue is full')
+        try:
+            future = self._get_executor().submit(detect_encoded_frames, frames, hints or [None] * len(frames))
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._task_done)
+        return future
+
+    def _task_done(self, future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def detect_many(self, frames, hints=None):
+        """Detect faces in several encoded frames in parallel; one (faces, timings) per frame"""
+        hints = hints or [None] * len(frames)
+        with STAGE_SECONDS.time('detection'):
+            results = self._detect_many(frames, hints)
+        for _, timings in results:
+            observe_timings(timings)
+        return results
+
+    def _detect_many(self, frames, hints):
+        if self.workers <= 0:
+            return detect_encoded_frames(frames, hints)
+
+        chunk = -(-len(frames) // self.workers)
+        try:
+            futures = [
+                self.submit(frames[i:i + chunk], hints[i:i + chunk])
+                for i in range(0, len(frames), chunk)
+            ]
+            return [result for future in futures for result in future.result(timeout=self.timeout)]
+        except FutureTimeout:
+            raise DetectorBusy('Face detection timed out')
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool on the next frame
+            logger.error("❌ Detection pool crashed, restarting")
+            self.shutdown()
+            raise DetectorBusy('Face detection worker crashed')
+
+    def detect(self, image_bytes, hint=None):
+        """Detect every face in one encoded frame; returns (faces, timings)"""
+        return self.detect_many([image_bytes], [hint])[0]
+
+    def detect_first(self, image_bytes, hint=None):
+        """(box, features, timings) for the first face in one encoded frame; box is None if none"""
+        faces, timings = self.detect(image_bytes, hint)
+        if not faces:
+            logger.debug("❌ No faces detected in image")
+            return None, None, timings
+        box, features = faces[0]
+        return box, features, timings
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+if __name__ == '__main__':
+    # Per-stage timings for tuning: python detection.py photo.jpg [photo2.jpg ...]
+    import json
+    import sys
+
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        faces, timings = detect_encoded(image_bytes)
+        report = {'image': path, 'faces': [list(box) for box, _ in faces], 'full_scan': timings}
+        if faces:
+            # Same frame again with its own box as the hint, as in continuous capture
+            report['tracked'] = detect_encoded(image_bytes, faces[0][0])[1]
+        print(json.dumps(report))
@@ -0,0 +1,214 @@
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from gallery import FEATURE_DIM, PIXEL_MODEL
+from preprocessing import load_eye_cascade, preprocess_faces
+
+logger = logging.getLogger(__name__)
+
+# EMBEDDING_BACKEND=pixels (default) keeps the raw 100x100 grayscale crops compared by
+# correlation; EMBEDDING_BACKEND=normalized aligns and equalizes those crops first;
+# EMBEDDING_BACKEND=dnn runs a CPU face-recognition model through cv2.dnn
+# (e.g. OpenCV Zoo's face_recognition_sface_2021dec.onnx, 112x112 input, 128-dim output).
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'pixels')
+EMBEDDING_MODEL_PATH = os.environ.get('EMBEDDING_MODEL_PATH', 'face_recognition_sface_2021dec.onnx')
+EMBEDDING_MODEL_VERSION = os.environ.get('EMBEDDING_MODEL_VERSION', '')
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', 128))
+EMBEDDING_INPUT_SIZE = int(os.environ.get('EMBEDDING_INPUT_SIZE', 112))
+EMBEDDING_MARGIN = float(os.environ.get('EMBEDDING_MARGIN', 0.1))
+# Cosine thresholds for the DNN backend (SFace's published operating point is 0.363)
+EMBEDDING_MATCH_THRESHOLD = float(os.environ.get('EMBEDDING_MATCH_THRESHOLD', 0.363))
+EMBEDDING_DUPLICATE_THRESHOLD = float(os.environ.get('EMBEDDING_DUPLICATE_THRESHOLD', 0.5))
+
+
+class PixelEmbedder:
+    """The original features: a face crop resized to 100x100 grayscale, flattened.
+
+    Stored as uint8 and compared by Pearson correlation (mean-centered cosine).
+    """
+
+    model_version = PIXEL_MODEL
+    dim = FEATURE_DIM
+    color = False
+    center = True
+    match_threshold = 0.7
+    duplicate_threshold = 0.8
+
+    def load(self):
+        return self
+
+    def embed(self, faces):
+        """Encode [(image, (x, y, w, h)), ...] into an (n, dim) uint8 array"""
+        rows = np.empty((len(faces), self.dim), dtype=np.uint8)
+        for i, (image, (x, y, w, h)) in enumerate(faces):
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            # Resize to standard size for comparison
+            rows[i] = cv2.resize(gray[y:y+h, x:x+w], (100, 100)).ravel()
+        return rows
+
+
+class NormalizedPixelEmbedder(PixelEmbedder):
+    """The pixel features with lighting and pose normalized (see preprocessing.py).
+
+    Faces are eye-aligned, masked to the face oval and histogram-equalized,
+    so correlation scores depend less on classroom lighting. Templates are
+    tagged with their own model version, since raw and normalized crops do
+    not compare.
+    """
+
+    model_version = f'{PIXEL_MODEL}-normalized'
+
+    def load(self):
+        load_eye_cascade()
+        return self
+
+    def embed(self, faces):
+        """Encode [(image, (x, y, w, h)), ...] into an (n, dim) uint8 array, all faces in one batch"""
+        if not faces:
+            return np.empty((0, self.dim), dtype=np.uint8)
+        return preprocess_faces(faces).reshape(len(faces), self.dim)
+
+
+class DnnEmbedder:
+    """Compact float32 embeddings from a CNN run with cv2.dnn on the CPU.
+
+    All faces passed to one `embed` call go through the network as a single
+    batch. Embeddings are L2-normalized and compared by cosine similarity.
+    """
+
+    color = True
+    center = False
+
+    def __init__(self, model_path=EMBEDDING_MODEL_PATH, dim=EMBEDDING_DIM, input_size=EMBEDDING_INPUT_SIZE,
+                 version=EMBEDDING_MODEL_VERSION, margin=EMBEDDING_MARGIN):
+        self.model_path = model_path
+        self.dim = dim
+        self.input_size = input_size
+        self.margin = margin
+        self.model_version = version or os.path.splitext(os.path.basename(model_path))[0]
+        self.match_threshold = EMBEDDING_MATCH_THRESHOLD
+        self.duplicate_threshold = EMBEDDING_DUPLICATE_THRESHOLD
+        self._net = None
+
+    def load(self):
+        if self._net is None:
+            logger.info(f"🧠 Loading embedding model from: {self.model_path}")
+            self._net = cv2.dnn.readNet(self.model_path)
+            self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            logger.info(f"✅ Embedding model {self.model_version} loaded")
+        return self
+
+    def embed(self, faces):
+        """Encode [(image, (x, y, w, h)), ...] into an (n, dim) float32 array in one forward pass"""
+        if not faces:
+            return np.empty((0, self.dim), dtype=np.float32)
+        self.load()
+
+        crops = []
+        for image, (x, y, w, h) in faces:
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            # A little context around the Haar box, which is tight on the face
+            pad_x, pad_y = int(w * self.margin), int(h * self.margin)
+            top, left = max(y - pad_y, 0), max(x - pad_x, 0)
+            crops.append(image[top:y + h + pad_y, left:x + w + pad_x])
+
+        size = (self.input_size, self.input_size)
+        blob = cv2.dnn.blobFromImages(crops, 1.0, size, (0, 0, 0), swapRB=True, crop=False)
+        self._net.setInput(blob)
+        embeddings = self._net.forward().reshape(len(crops), -1).astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return embeddings / norms
+
+
+_embedder = None
+
+
+def get_embedder():
+    """The configured embedder for this process (the model itself loads on first use)"""
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_BACKEND == 'dnn':
+            _embedder = DnnEmbedder()
+        elif EMBEDDING_BACKEND == 'normalized':
+            _embedder = NormalizedPixelEmbedder()
+        else:
+            _embedder = PixelEmbedder()
+    return _embedder
+
+
+def reembed(store, detector, references, max_templates=None, batch_size=64):
+    """Re-encode every student whose templates come from another model.
+
+    Students with a saved face thumbnail are embedded straight from it;
+    otherwise their reference photo is detected and embedded again, and
+    students without a usable photo fall back to their stored pixel crops.
+    Returns a report of re-embedded rolls, rolls already on the current
+    model and rolls that could not be converted.
+    """
+    embedder = get_embedder()
+    report = {'reembedded': [], 'current': [], 'failed': []}
+    stale = []
+    for student in store.iter_students(with_encodings=True):
+        if student.get('encoding_model', PIXEL_MODEL) == embedder.model_version:
+            report['current'].append(student['roll'])
+        else:
+            stale.append(student)
+
+    references.flush()
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start:start + batch_size]
+        thumbnails, thumbnail_rolls, frames, photo_rolls = [], [], [], []
+        for student in batch:
+            thumbnail = references.thumbnail(student['roll'], color=embedder.color)
+            if thumbnail is not None:
+                thumbnails.append(thumbnail)
+                thumbnail_rolls.append(student['roll'])
+                continue
+            image_bytes = references.reference(student['roll'])
+            if image_bytes is not None:
+                frames.append(image_bytes)
+                photo_rolls.append(student['roll'])
+
+        # Thumbnails need neither a full-frame decode nor detection: one embedding batch
+        encodings = {roll: features[None] for roll, features in zip(thumbnail_rolls, embedder.embed(thumbnails))}
+        for roll, (faces, _) in zip(photo_rolls, detector.detect_many(frames) if frames else []):
+            if faces:
+                encodings[roll] = np.asarray([faces[0][1]])
+
+        for student in batch:
+            roll = student['roll']
+            if roll not in encodings and student.get('encoding_model', PIXEL_MODEL) == PIXEL_MODEL:
+                crops = np.asarray(student.get('encodings', []))
+                if crops.size and crops.shape[-1] == FEATURE_DIM:
+                    crops = crops.reshape(-1, 100, 100).astype(np.uint8)
+                    encodings[roll] = embedder.embed([(crop, (0, 0, 100, 100)) for crop in crops])
+            if roll not in encodings:
+                logger.error(f"❌ Could not re-embed {roll}: no reference photo or usable templates")
+                report['failed'].append(roll)
+                continue
+            store.add_encodings(roll, encodings[roll], max_templates, model=embedder.model_version, replace=True)
+            report['reembedded'].append(roll)
+
+        logger.info(f"🔁 Re-embedded {min(start + batch_size, len(stale))}/{len(stale)} stale students")
+
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    if sys.argv[1:] != ['reembed']:
+        print("Usage: python embeddings.py reembed")
+        sys.exit(1)
+
+    from app import MAX_TEMPLATES, detector, reference_writer, store
+
+    result = reembed(store, detector, reference_writer, max_templates=MAX_TEMPLATES)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,177 @@
+"""Bulk enrollment from a folder or ZIP of {roll}.jpg reference photos.
+
+An optional students.csv (columns: roll,name) next to the photos supplies
+names; students without one are named after their roll number. Photos are
+detected in parallel on the detection pool, then deduplicated with one
+matrix pass against each other and against the existing gallery.
+
+    python enrollment.py photos/        or        python enrollment.py photos.zip
+"""
+import csv
+import io
+import logging
+import os
+import time
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+from detection import DETECTION_RETRY_AFTER, DetectorBusy
+from gallery import normalize_encodings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+MANIFEST_NAME = 'students.csv'
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 256))
+
+
+def _read_manifest(data):
+    reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig')))
+    return {row['roll'].strip(): row['name'].strip() for row in reader if row.get('roll') and row.get('name')}
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_source(source):
+    """Return ({roll: name}, [(roll, read_bytes)]) for a folder path, ZIP path or ZIP file object"""
+    if isinstance(source, str) and os.path.isdir(source):
+        names, photos = {}, []
+        for filename in sorted(os.listdir(source)):
+            path = os.path.join(source, filename)
+            roll, ext = os.path.splitext(filename)
+            if filename == MANIFEST_NAME:
+                with open(path, 'rb') as f:
+                    names = _read_manifest(f.read())
+            elif ext.lower() in IMAGE_EXTENSIONS and os.path.isfile(path):
+                photos.append((roll, lambda path=path: _read_file(path)))
+        return names, photos
+
+    archive = zipfile.ZipFile(source)
+    names, photos = {}, []
+    for info in sorted(archive.infolist(), key=lambda info: info.filename):
+        filename = os.path.basename(info.filename)
+        roll, ext = os.path.splitext(filename)
+        if info.is_dir() or filename.startswith('.'):
+            continue
+        if filename == MANIFEST_NAME:
+            names = _read_manifest(archive.read(info))
+        elif ext.lower() in IMAGE_EXTENSIONS:
+            photos.append((roll, lambda info=info: archive.read(info)))
+    return names, photos
+
+
+def first_of_duplicates(templates, threshold):
+    """Index of an earlier kept template each template duplicates (or -1), from one all-pairs pass"""
+    similar = np.triu(templates @ templates.T > threshold, 1)
+    duplicate_of = [-1] * len(templates)
+    kept = np.ones(len(templates), dtype=bool)
+    for j in range(len(templates)):
+        earlier = np.flatnonzero(similar[:j, j] & kept[:j])
+        if earlier.size:
+            duplicate_of[j] = int(earlier[0])
+            kept[j] = False
+    return duplicate_of
+
+
+def _detect(detector, frames, attempts=5):
+    # Share the pool politely with live traffic: wait and retry when its queue is full
+    for attempt in range(attempts):
+        try:
+            return detector.detect_many(frames)
+        except DetectorBusy:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(DETECTION_RETRY_AFTER)
+
+
+def bulk_enroll(source, store, gallery, detector, save_image=None, threshold=0.8, batch_size=BULK_BATCH_SIZE):
+    """Register every photo in `source` that holds a face not already enrolled.
+
+    Returns a report listing enrolled rolls and, for the rest, why they were
+    skipped. `save_image(roll, image_bytes, box)` persists the reference photo.
+    """
+    names, photos = read_source(source)
+    report = {'enrolled': [], 'already_registered': [], 'no_face': [], 'duplicates': [], 'failed': []}
+
+    for start in range(0, len(photos), batch_size):
+        batch = []
+        for roll, read in photos[start:start + batch_size]:
+            if roll in gallery or store.find_student(roll):
+                report['already_registered'].append(roll)
+            else:
+                batch.append((roll, read()))
+        if not batch:
+            continue
+
+        # Detection runs across all pool workers at once
+        detections = _detect(detector, [image_bytes for _, image_bytes in batch])
+        candidates, features = [], []
+        for (roll, image_bytes), (faces, _) in zip(batch, detections):
+            if not faces:
+                report['no_face'].append(roll)
+                continue
+            encoding = normalize_encodings(faces[0][1], gallery.dim, center=gallery.center)
+            if encoding is None:
+                report['no_face'].append(roll)
+                continue
+            candidates.append((roll, image_bytes, faces[0]))
+            features.append(encoding[0])
+        if not candidates:
+            continue
+
+        templates = np.vstack(features)
+        duplicate_of = first_of_duplicates(templates, threshold)
+        existing = gallery.best_matches(templates, threshold=threshold, exact=True)
+
+        enrolled = []
+        for i, ((roll, image_bytes, (box, face_features)), twin, match) in enumerate(zip(candidates, duplicate_of, existing)):
+            if match is not None:
+                report['duplicates'].append({'roll': roll, 'matches': match[0], 'score': round(match[2], 4)})
+                continue
+            if twin >= 0:
+                score = float(templates[i] @ templates[twin])
+                report['duplicates'].append({'roll': roll, 'matches': candidates[twin][0], 'score': round(score, 4)})
+                continue
+
+            name = names.get(roll, roll)
+            try:
+                store.add_student(
+                    {'roll': roll, 'name': name, 'registered_at': datetime.now().isoformat() + 'Z'},
+                    face_features,
+                    model=gallery.model
+                )
+                if save_image is not None:
+                    save_image(roll, image_bytes, box)
+            except Exception as e:
+                logger.error(f"❌ Could not enroll {roll}: {e}")
+                report['failed'].append({'roll': roll, 'error': str(e)})
+                continue
+            enrolled.append({'roll': roll, 'name': name, 'encodings': face_features, 'encoding_model': gallery.model})
+            report['enrolled'].append(roll)
+
+        # One gallery update per batch (a single publish for a shared gallery)
+        gallery.update(enrolled)
+
+        logger.info(f"📥 Bulk enrollment: {min(start + batch_size, len(photos))}/{len(photos)} photos processed")
+
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python enrollment.py <folder or .zip of {roll}.jpg photos>")
+        sys.exit(1)
+
+    from app import detector, get_face_gallery, reference_writer, store, write_reference_image
+
+    result = bulk_enroll(sys.argv[1], store, get_face_gallery(), detector, save_image=write_reference_image)
+    reference_writer.flush()
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,66 @@
+import csv
+import tempfile
+from io import StringIO
+
+from flask import Response, send_file, stream_with_context
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Rows per CSV chunk sent to the client
+CSV_CHUNK_ROWS = 500
+
+
+def csv_chunks(header, rows, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield CSV text a few hundred rows at a time"""
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows):
+    """Stream rows to the client as a CSV download without building it in memory"""
+    return Response(
+        stream_with_context(csv_chunks(header, rows)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def xlsx_file(sheet_name, header, rows):
+    """Write rows with openpyxl's write-only mode to a temp file, rewound for reading"""
+    # openpyxl takes a noticeable share of startup; only the Excel exports need it
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def xlsx_response(filename, sheet_name, header, rows):
+    """Build the Excel file and send it"""
+    # send_file streams the file in chunks and closes (deleting) it afterwards
+    output = xlsx_file(sheet_name, header, rows)
+    return send_file(output, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+
+
+def export_response(format, basename, sheet_name, header, rows):
+    """Build the CSV or Excel download for `format`, or None if the format is unknown"""
+    if format.lower() == 'excel':
+        return xlsx_response(f'{basename}.xlsx', sheet_name, header, rows)
+    if format.lower() == 'csv':
+        return csv_response(f'{basename}.csv', header, rows)
+    return None
@@ -0,0 +1,323 @@
+import threading
+
+import numpy as np
+
+# Default encodings are flattened 100x100 grayscale face crops
+FEATURE_DIM = 100 * 100
+# Model-version tag of those encodings (documents without a tag have them)
+PIXEL_MODEL = 'pixels-100x100'
+
+
+def normalize_encoding(features, center=True):
+    """Return a zero-mean (if `center`), unit-norm float32 copy of a face encoding.
+
+    The dot product of two normalized encodings equals their Pearson
+    correlation (np.corrcoef); without centering it is their cosine
+    similarity.
+    """
+    vec = np.asarray(features, dtype=np.float32).ravel()
+    if center:
+        vec = vec - vec.mean()
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        return None
+    return vec / norm
+
+
+def normalize_encodings(features, dim=FEATURE_DIM, center=True):
+    """Normalize a stack of encodings row-wise, dropping blank rows; None if unusable"""
+    matrix = np.asarray(features, dtype=np.float32)
+    if matrix.size == 0 or matrix.shape[-1] != dim:
+        return None
+    matrix = matrix.reshape(-1, dim)
+    if center:
+        matrix = matrix - matrix.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    keep = norms[:, 0] > 0
+    if not keep.any():
+        return None
+    return matrix[keep] / norms[keep]
+
+
+def _student_scores(template_scores, owners, n_students):
+    """Reduce per-template scores to each student's best score (-inf for none)"""
+    scores = np.full(n_students, -np.inf, dtype=np.float32)
+    live = owners >= 0
+    np.maximum.at(scores, owners[live], template_scores[live])
+    return scores
+
+
+class FaceGallery:
+    """In-memory matrix of normalized face templates for vectorized matching.
+
+    Each student has one or more templates (encodings captured at
+    enrollment). Templates are rows of a preallocated buffer that grows by
+    doubling, and `owners` maps every row back to its student. A student's
+    score is the maximum over their templates, so the best match is simply
+    the best-scoring row. Only encodings tagged with the gallery's `model`
+    are loaded, and `threshold` is the default match threshold for that
+    model. `generation` is an opaque token set by the caller to remember
+    which version of the backing store the gallery reflects.
+    """
+
+    def __init__(self, dim=FEATURE_DIM, model=PIXEL_MODEL, center=True, threshold=0.7):
+        self.dim = dim
+        self.model = model
+        self.center = center
+        self.threshold = threshold
+        self._buffer = np.empty((0, dim), dtype=np.float32)
+        self._owners = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._index = {}
+        self._rows = []
+        self._free = []
+        self.rolls = []
+        self.names = []
+        self.loaded = False
+        self.generation = None
+        self.source = None  # Which store `generation` refers to
+        self.ann = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rolls)
+
+    def __contains__(self, roll):
+        return roll in self._index
+
+    @property
+    def matrix(self):
+        return self._buffer[:self._size]
+
+    @property
+    def owners(self):
+        return self._owners[:self._size]
+
+    def template_rolls(self):
+        """Roll of every template row ('' for rows freed when a student's templates shrank)"""
+        with self._lock:
+            owners, rolls = self.owners.tolist(), self.rolls
+        return [rolls[owner] if owner >= 0 else '' for owner in owners]
+
+    def templates(self, roll):
+        """The normalized templates stored for one student, or None"""
+        with self._lock:
+            student = self._index.get(roll)
+            if student is None:
+                return None
+            return self._buffer[self._rows[student]]
+
+    def load(self, students, generation=None, source=None):
+        """Rebuild the gallery from an iterable of student documents"""
+        # Append-only stores can list a student again after an update; the last copy wins
+        latest = {}
+        for student in students:
+            latest[student['roll']] = (student['name'], self._student_encodings(student))
+
+        blocks, owners, rows, rolls, names = [], [], [], [], []
+        size = 0
+        for roll, (name, encodings) in latest.items():
+            if encodings is None:
+                continue
+            blocks.append(encodings)
+            owners.extend([len(rolls)] * len(encodings))
+            rows.append(list(range(size, size + len(encodings))))
+            size += len(encodings)
+            rolls.append(roll)
+            names.append(name)
+
+        buffer = np.vstack(blocks) if blocks else np.empty((0, self.dim), dtype=np.float32)
+        with self._lock:
+            self._buffer = np.ascontiguousarray(buffer, dtype=np.float32)
+            self._owners = np.asarray(owners, dtype=np.int32)
+            self._size = size
+            self._index = {roll: student for student, roll in enumerate(rolls)}
+            self._rows = rows
+            self._free = []
+            self.rolls = rolls
+            self.names = names
+            self.generation = generation
+            self.source = source
+            self.ann = None
+            self.loaded = True
+
+    def update(self, students, generation=None):
+        """Add or replace the templates of the given student documents in place"""
+        added = 0
+        for student in students:
+            encodings = self._student_encodings(student)
+            if encodings is not None:
+                self._put(student['roll'], student['name'], encodings)
+                added += 1
+        if generation is not None:
+            self.generation = generation
+        return added
+
+    def refresh(self):
+        """Pick up a gallery published by another process; a private gallery has none"""
+        return False
+
+    def add(self, roll, name, features):
+        """Set a single student's templates from one encoding or a stack of them"""
+        encodings = normalize_encodings(features, self.dim, self.center)
+        if encodings is None:
+            return False
+        self._put(roll, name, encodings)
+        return True
+
+    def attach_index(self, index):
+        """Route best_match through an approximate index built over these rows"""
+        with self._lock:
+            self.ann = index
+
+    def invalidate(self):
+        """Force a full reload on next use"""
+        with self._lock:
+            self.loaded = False
+
+    def scores(self, features):
+        """Score a probe encoding against every student (max over their templates)"""
+        probe = normalize_encoding(features, self.center)
+        with self._lock:
+            matrix, owners, rolls, names = self.matrix, self.owners, self.rolls, self.names
+        if probe is None or probe.shape[0] != self.dim or matrix.shape[0] == 0:
+            return np.empty(0, dtype=np.float32), rolls, names
+        return _student_scores(matrix @ probe, owners, len(rolls)), rolls, names
+
+    def top_matches(self, features, k=5):
+        """The k students closest to one identity, best first, as [(roll, name, score), ...].
+
+        `features` is one encoding or a stack of encodings of the same person;
+        a student's score is the best over all probe/template pairs. Always
+        exact, even when an approximate index is attached.
+        """
+        probes = normalize_encodings(features, self.dim, self.center)
+        with self._lock:
+            matrix, owners, rolls, names = self.matrix, self.owners, self.rolls, self.names
+        if probes is None or matrix.shape[0] == 0:
+            return []
+        scores = _student_scores((probes @ matrix.T).max(axis=0), owners, len(rolls))
+        k = min(k, len(rolls))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(rolls[i], names[i], float(scores[i])) for i in top.tolist() if np.isfinite(scores[i])]
+
+    def best_match(self, features, threshold=None):
+        """Return (roll, name, score) of the best match above threshold, or None"""
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            ann = self.ann
+        if ann is not None:
+            return self._best_match_ann(ann, features, threshold)
+
+        probe = normalize_encoding(features, self.center)
+        with self._lock:
+            matrix, owners, rolls, names = self.matrix, self.owners, self.rolls, self.names
+        if probe is None or probe.shape[0] != self.dim or matrix.shape[0] == 0:
+            return None
+        # The best template row belongs to the student with the best max-over-templates score
+        scores = matrix @ probe
+        scores[owners < 0] = -np.inf  # Freed rows may still hold a replaced template
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score <= threshold:
+            return None
+        student = int(owners[best])
+        return rolls[student], names[student], score
+
+    def best_matches(self, features, threshold=None, exact=False):
+        """Match a stack of probe encodings at once; returns a match or None per probe"""
+        threshold = self.threshold if threshold is None else threshold
+        probes = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            matrix, owners, rolls, names, ann = self.matrix, self.owners, self.rolls, self.names, self.ann
+        if ann is not None and not exact:
+            return [self._best_match_ann(ann, probe, threshold) for probe in probes]
+        if matrix.shape[0] == 0:
+            return [None] * len(probes)
+
+        if self.center:
+            probes = probes - probes.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(probes, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        scores = (probes / norms) @ matrix.T
+        scores[:, owners < 0] = -np.inf
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(len(probes)), best]
+
+        matches = []
+        for student, score in zip(owners[best].tolist(), best_scores.tolist()):
+            matches.append((rolls[student], names[student], score) if score > threshold else None)
+        return matches
+
+    def _best_match_ann(self, ann, features, threshold):
+        probe = normalize_encoding(features, self.center)
+        with self._lock:
+            matrix, owners, rolls, names = self.matrix, self.owners, self.rolls, self.names
+        if probe is None or probe.shape[0] != self.dim or matrix.shape[0] == 0:
+            return None
+
+        # Verify the approximate candidates with exact full-size scores
+        candidates = ann.search(probe)
+        candidates = candidates[candidates < matrix.shape[0]]
+        candidates = candidates[owners[candidates] >= 0]
+        if candidates.size == 0:
+            return None
+        scores = matrix[candidates] @ probe
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score <= threshold:
+            return None
+        student = int(owners[candidates[best]])
+        return rolls[student], names[student], score
+
+    def _student_encodings(self, student):
+        if student.get('encoding_model', PIXEL_MODEL) != self.model:
+            return None  # Not re-embedded for the current model yet
+        try:
+            return normalize_encodings(student['encodings'], self.dim, self.center)
+        except (KeyError, TypeError, ValueError):
+            return None  # Skip if encodings not found or corrupted
+
+    def _grow(self, needed):
+        capacity = max(64, 2 * self._buffer.shape[0], needed)
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:self._size] = self._buffer[:self._size]
+        owners = np.full(capacity, -1, dtype=np.int32)
+        owners[:self._size] = self._owners[:self._size]
+        self._buffer, self._owners = grown, owners
+
+    def _put(self, roll, name, encodings):
+        with self._lock:
+            student = self._index.get(roll)
+            if student is None:
+                student = len(self.rolls)
+                self.rolls.append(roll)
+                self.names.append(name)
+                self._rows.append([])
+            else:
+                self.names[student] = name
+
+            # Overwrite the student's existing rows, then reuse freed rows, then append
+            old_rows = self._rows[student]
+            rows = old_rows[:len(encodings)]
+            for row in old_rows[len(encodings):]:
+                self._buffer[row] = 0
+                self._owners[row] = -1
+                self._free.append(row)
+            while len(rows) < len(encodings) and self._free:
+                rows.append(self._free.pop())
+            missing = len(encodings) - len(rows)
+            if self._size + missing > self._buffer.shape[0]:
+                self._grow(self._size + missing)
+            new_rows = list(range(self._size, self._size + missing))
+            rows = rows + new_rows
+
+            # Fill the rows before publishing them so concurrent readers never see them half-written
+            self._buffer[rows] = encodings
+            self._owners[rows] = student
+            self._rows[student] = rows
+            self._index[roll] = student
+            self._size += len(new_rows)
+            if self.ann is not None:
+                self.ann.add(np.asarray(rows), encodings)
@@ -0,0 +1,73 @@
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class LiveSession:
+    """State for one live webcam stream.
+
+    The connection thread hands each received frame to `push`; a processing
+    thread recognizes only the newest one. A frame that arrives while an older
+    one is still waiting replaces it and is counted as dropped, so a slow server
+    skips frames instead of falling further and further behind the camera.
+    `process_frame(session, frame)` returns the events to send back, which are
+    passed to `send` from the processing thread.
+    """
+
+    def __init__(self, process_frame, send):
+        self.id = uuid.uuid4().hex[:12]
+        self.box = None  # Last face box, searched first in the next frame
+        self.seen = set()  # Rolls already reported to this client
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self._process_frame = process_frame
+        self._send = send
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'live-{self.id}')
+        self._thread.start()
+
+    def push(self, frame):
+        """Queue the newest frame, replacing (dropping) one that is still waiting"""
+        with self._condition:
+            self.received += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = frame
+            self._condition.notify()
+
+    def drop(self):
+        """Count a frame the processor had to give up on (e.g. detection queue full)"""
+        with self._condition:
+            self.dropped += 1
+
+    def stats(self):
+        return {'received': self.received, 'processed': self.processed, 'dropped': self.dropped}
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                frame, self._pending = self._pending, None
+
+            try:
+                events = self._process_frame(self, frame)
+                self.processed += 1
+                for event in events:
+                    self._send(event)
+            except Exception as e:
+                # Most likely the client went away mid-send; the connection thread closes us
+                logger.warning(f"⚠️ Live session {self.id} frame failed: {e}")
@@ -0,0 +1,177 @@
+"""Logging setup and per-stage metrics in the Prometheus text format.
+
+LOG_LEVEL sets the level (INFO by default; DEBUG brings back the
+per-request detail) and LOG_FORMAT=json writes one JSON object per line,
+including any `extra` fields. Metrics live in each process, so every
+gunicorn worker reports its own on /metrics.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+# Seconds; covers everything from a sub-millisecond match to the 2 s request budget
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, format=LOG_FORMAT):
+    """Send log records to stdout at `level`, as text or JSON lines (idempotent)"""
+    root = logging.getLogger()
+    if getattr(root, '_attendance_configured', False):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    if format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(level)
+    root._attendance_configured = True
+
+
+def _labels(label, value, **extra):
+    pairs = ([(label, value)] if label else []) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{val}"' for key, val in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values) or {None: 0}
+        for value, count in sorted(values.items(), key=lambda item: str(item[0])):
+            lines.append(f'{self.name}{_labels(self.label, value)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read from `read()` at scrape time"""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {value}']
+
+
+class Histogram:
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> ([count per bucket], sum, count)
+        self._lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        with self._lock:
+            counts, total, count = self._series.get(label) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[label] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for value, (counts, total, count) in sorted(series.items(), key=lambda item: str(item[0])):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(self.label, value, le=bound)} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_labels(self.label, value, le="+Inf")} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.label, value)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label, value)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'attendance_stage_seconds', 'Latency of each processing stage (decode, roi, detect, embed, match, db_read, db_write)',
+    label='stage'
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    'attendance_request_seconds', 'Request latency by endpoint', label='endpoint'
+))
+RECOGNITIONS = registry.register(Counter('attendance_recognitions_total', 'Frames submitted for recognition'))
+NO_FACE = registry.register(Counter('attendance_no_face_total', 'Recognition frames without a detected face'))
+MATCHES = registry.register(Counter('attendance_matches_total', 'Faces matched to a registered student'))
+UNKNOWN_FACES = registry.register(Counter('attendance_unknown_faces_total', 'Faces that matched no registered student'))
+MARKED = registry.register(Counter('attendance_marked_total', 'New attendance marks'))
+REGISTRATIONS = registry.register(Counter('attendance_registrations_total', 'Students registered'))
+DETECTOR_BUSY = registry.register(Counter('attendance_detector_busy_total', 'Frames refused because the detection queue was full'))
+RECOGNITION_CACHE = registry.register(Counter(
+    'attendance_recognition_cache_total', 'Recognition cache lookups by result (hit, miss)', label='result'
+))
+
+
+def observe_timings(timings):
+    """Record the `<stage>_ms` entries of a timings dict in the stage histogram"""
+    for key, value in timings.items():
+        if key.endswith('_ms') and isinstance(value, (int, float)):
+            STAGE_SECONDS.observe(value / 1000, key[:-3])
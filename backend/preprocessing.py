@@ -0,0 +1,133 @@
+"""Face crop normalization (eye alignment, oval mask, equalization) for the pixel features"""
+import functools
+import logging
+import math
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EYE_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_eye.xml'
+
+FACE_SIZE = 100
+# Histogram bins are capped at CLIP_LIMIT times the average before equalizing, so flat
+# skin does not get stretched into noise
+CLIP_LIMIT = 3.0
+MASK_FILL = 128
+# Eyes are searched in this band of the crop (fractions of its height)
+EYE_BAND = (0.15, 0.6)
+# Tilts beyond this are more likely a wrong eye pair than a tilted head
+MAX_ALIGN_DEGREES = 25
+MIN_ALIGN_DEGREES = 1
+
+_eye_cascade = None
+
+
+def load_eye_cascade():
+    """Load OpenCV's bundled eye cascade for this process; None disables alignment"""
+    global _eye_cascade
+    if _eye_cascade is None:
+        cascade = cv2.CascadeClassifier(EYE_CASCADE_PATH)
+        if cascade.empty():
+            logger.error(f"❌ Eye cascade not found at {EYE_CASCADE_PATH}; faces will not be aligned")
+            return None
+        _eye_cascade = cascade
+    return _eye_cascade
+
+
+@functools.lru_cache(maxsize=None)
+def oval_mask(size=FACE_SIZE):
+    """Boolean size x size mask of the face oval (the corners hold background and hair)"""
+    y, x = np.ogrid[:size, :size]
+    center = (size - 1) / 2
+    return ((x - center) / (0.46 * size)) ** 2 + ((y - center) / (0.52 * size)) ** 2 <= 1
+
+
+def _grayscale(image):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def eye_angles(crops):
+    """Tilt in degrees of the eye line of each size x size crop, 0 where no eye pair was found"""
+    angles = np.zeros(len(crops))
+    cascade = load_eye_cascade()
+    if cascade is None:
+        return angles
+
+    size = crops.shape[1]
+    top, bottom = int(EYE_BAND[0] * size), int(EYE_BAND[1] * size)
+    min_eye, max_eye = max(size // 10, 8), bottom - top
+    # The cascade runs per crop; one call over a mosaic of eye bands was no faster
+    for i, crop in enumerate(crops):
+        # Largest eye on each half of the face
+        sides = {}
+        for x, y, w, h in cascade.detectMultiScale(crop[top:bottom], 1.1, 3, minSize=(min_eye, min_eye), maxSize=(max_eye, max_eye)):
+            center = (x + w / 2, y + top + h / 2)
+            side = 'left' if center[0] < size / 2 else 'right'
+            if side not in sides or w * h > sides[side][0]:
+                sides[side] = (w * h, center)
+        if len(sides) == 2:
+            (lx, ly), (rx, ry) = sides['left'][1], sides['right'][1]
+            angle = math.degrees(math.atan2(ry - ly, rx - lx))
+            if abs(angle) <= MAX_ALIGN_DEGREES:
+                angles[i] = angle
+    return angles
+
+
+def equalize(crops, mask, clip_limit=CLIP_LIMIT, fill=MASK_FILL):
+    """Contrast-limited histogram equalization of each crop over `mask`, for a stack of crops"""
+    # Each crop is equalized over its own oval only, so its pixels do not depend on
+    # whichever faces share the batch
+    count = len(crops)
+    values = crops[:, mask]  # (n, pixels in mask)
+    # One bincount for every crop's histogram: crop i's values land in bins i*256..i*256+255
+    offsets = (np.arange(count) * 256)[:, None]
+    hist = np.bincount((values + offsets).ravel(), minlength=count * 256).reshape(count, 256).astype(np.float64)
+    limit = clip_limit * values.shape[1] / 256
+    excess = np.maximum(hist - limit, 0).sum(axis=1, keepdims=True)
+    hist = np.minimum(hist, limit) + excess / 256
+    cdf = hist.cumsum(axis=1)
+    span = np.maximum(cdf[:, -1:] - cdf[:, :1], 1)
+    lut = np.round((cdf - cdf[:, :1]) / span * 255).astype(np.uint8)
+
+    out = np.full_like(crops, fill)
+    out[:, mask] = np.take_along_axis(lut, values.astype(np.intp), axis=1)
+    return out
+
+
+def _crop_matrix(box, angle, size):
+    """Affine map from the frame to a size x size crop of `box` rotated by `angle` degrees"""
+    x, y, w, h = box
+    center = (x + w / 2, y + h / 2)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    # Then scale the box to size x size around the crop's center
+    scale = np.array([[size / w, 0], [0, size / h]])
+    matrix = scale @ matrix
+    matrix[:, 2] += np.array([size / 2, size / 2]) - scale @ np.array(center)
+    return matrix
+
+
+def preprocess_faces(faces, size=FACE_SIZE, align=True, clip_limit=CLIP_LIMIT):
+    """Aligned, masked and equalized grayscale crops for [(image, (x, y, w, h)), ...].
+
+    Returns a (n, size, size) uint8 stack.
+    """
+    crops = np.empty((len(faces), size, size), dtype=np.uint8)
+    grays = {}  # Convert each frame to grayscale once, however many faces it holds
+    for i, (image, (x, y, w, h)) in enumerate(faces):
+        gray = grays.get(id(image))
+        if gray is None:
+            gray = grays[id(image)] = _grayscale(image)
+        crops[i] = cv2.resize(gray[y:y+h, x:x+w], (size, size))
+
+    if align:
+        # Only tilted faces are cut again, in one warp from the frame (no double resampling)
+        for i, angle in enumerate(eye_angles(crops)):
+            if abs(angle) >= MIN_ALIGN_DEGREES:
+                image, box = faces[i]
+                crops[i] = cv2.warpAffine(
+                    grays[id(image)], _crop_matrix(box, angle, size), (size, size),
+                    flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+                )
+    return equalize(crops, oval_mask(size), clip_limit)
@@ -0,0 +1,99 @@
+"""Short-lived cache of recognition results for near-identical webcam frames"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from observability import RECOGNITION_CACHE
+
+# Capture sessions kept (0 disables the cache) and results kept per session
+RECOGNITION_CACHE_SIZE = int(os.environ.get('RECOGNITION_CACHE_SIZE', 1024))
+RECOGNITION_CACHE_ENTRIES = 4
+# Every result, recognized or not, is reused for at most this long. A longer life would let
+# a different student who steps into the same spot inherit the previous one's identity, and
+# an unknown face would miss a registration made meanwhile. The attendance writer already
+# stops a recognized student from being marked twice in a day.
+RECOGNITION_CACHE_TTL = float(os.environ.get('RECOGNITION_CACHE_TTL', 1.0))
+# Differing hash bits (of 64) still counted as the same frame. A student in front of the
+# camera sends almost the same frame several times a second, and each such frame skips
+# detection and matching.
+RECOGNITION_CACHE_DISTANCE = int(os.environ.get('RECOGNITION_CACHE_DISTANCE', 6))
+
+REDUCED_SCALE = 4
+
+
+def reduced_frame(image_bytes):
+    """Grayscale frame at 1/4 size; JPEG decoding skips most of the work at this scale"""
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+
+
+def face_hash(frame, box, scale=REDUCED_SCALE):
+    """64-bit difference hash of the full-resolution `box` in a reduced frame, or None"""
+    x, y, w, h = (max(int(v) // scale, 0) for v in box)
+    roi = frame[y:y + h, x:x + w]
+    if roi.shape[0] < 2 or roi.shape[1] < 2:
+        return None
+    small = cv2.resize(roi, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+class RecognitionCache:
+    """LRU of capture sessions, each with its latest (hash, box, match, expiry) results"""
+
+    def __init__(self, size=RECOGNITION_CACHE_SIZE, ttl=RECOGNITION_CACHE_TTL,
+                 max_distance=RECOGNITION_CACHE_DISTANCE, entries=RECOGNITION_CACHE_ENTRIES):
+        self.size = size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.entries = entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def frame(self, session, image_bytes):
+        """The reduced frame to hash, or None when this request cannot use the cache"""
+        if self.size <= 0 or not session:
+            return None
+        return reduced_frame(image_bytes)
+
+    def get(self, session, frame, box):
+        """(box, match) from a recent near-identical frame of the session, or None"""
+        if frame is None or box is None:
+            return None
+        # `box` is where the ROI tracker expects the face, taken from the previous frame
+        key = face_hash(frame, box)
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            results = self._sessions.get(session, [])
+            for entry_key, entry_box, match, expires in reversed(results):
+                if expires > now and bin(key ^ entry_key).count('1') <= self.max_distance:
+                    self._sessions.move_to_end(session)
+                    RECOGNITION_CACHE.inc(label='hit')
+                    return entry_box, match
+        RECOGNITION_CACHE.inc(label='miss')
+        return None
+
+    def put(self, session, frame, box, match):
+        """Remember the result for the face found at `box`"""
+        if frame is None or box is None:
+            return
+        key = face_hash(frame, box)
+        if key is None:
+            return
+        now = time.monotonic()
+        expires = now + self.ttl
+        with self._lock:
+            results = [entry for entry in self._sessions.pop(session, []) if entry[3] > now]
+            results.append((key, tuple(box), match, expires))
+            self._sessions[session] = results[-self.entries:]
+            while len(self._sessions) > self.size:
+                self._sessions.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
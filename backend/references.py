@@ -0,0 +1,165 @@
+"""Reference photos and face thumbnails, written off the request thread"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails are THUMBNAIL_SIZE pixels square, with THUMBNAIL_MARGIN of the face size
+# as context on each side (room for the DNN embedder's own margin)
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 192))
+THUMBNAIL_MARGIN = float(os.environ.get('THUMBNAIL_MARGIN', 0.25))
+THUMBNAIL_QUALITY = 95
+
+
+def face_thumbnail(image, box, size=THUMBNAIL_SIZE, margin=THUMBNAIL_MARGIN):
+    """Square crop around `box` scaled to size x size; returns (thumbnail, face box inside it)"""
+    x, y, w, h = (int(v) for v in box)
+    side = int(round(max(w, h) * (1 + 2 * margin)))
+    left, top = x + w // 2 - side // 2, y + h // 2 - side // 2
+    # Faces near the frame edge get a black border instead of a squashed crop
+    pad = max(0, -left, -top, left + side - image.shape[1], top + side - image.shape[0])
+    if pad:
+        image = cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_CONSTANT)
+    crop = image[top + pad:top + pad + side, left + pad:left + pad + side]
+    scale = size / side
+    thumbnail = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+    face = [int(round(v * scale)) for v in (x - left, y - top, w, h)]
+    return thumbnail, face
+
+
+def _write_durably(path, data):
+    """Write `data` to `path` atomically and fsync it and its directory"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ReferenceWriter:
+    """Queues reference photos and writes them, with a face thumbnail, in the background.
+
+    `save` returns straight away; a writer thread (started on first use, so
+    one runs in each gunicorn worker) hashes, decodes, crops and writes.
+    With `background=False` the same work happens inline. `flush` waits for
+    queued writes, e.g. before reading them back.
+    """
+
+    def __init__(self, folder, background=True, thumbnail_size=THUMBNAIL_SIZE, margin=THUMBNAIL_MARGIN):
+        self.folder = folder
+        self.background = background
+        self.thumbnail_size = thumbnail_size
+        self.margin = margin
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @property
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def save(self, roll, image_bytes, box=None):
+        """Persist a student's reference photo and, given the face `box`, its thumbnail"""
+        if not self.background:
+            self._write(roll, image_bytes, box)
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name='reference-writer')
+                self._thread.start()
+        self._queue.put((roll, image_bytes, box))
+
+    def flush(self):
+        """Block until every queued image is on disk"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            roll, image_bytes, box = self._queue.get()
+            try:
+                self._write(roll, image_bytes, box)
+            except Exception as e:
+                logger.error(f"❌ Could not save reference image for {roll}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, roll, image_bytes, box):
+        manifest = {
+            'roll': roll,
+            'reference': self._put_object(image_bytes),
+            'saved_at': datetime.now().isoformat() + 'Z'
+        }
+        if box is not None:
+            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                thumbnail, face = face_thumbnail(image, box, self.thumbnail_size, self.margin)
+                ok, encoded = cv2.imencode('.jpg', thumbnail, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+                if ok:
+                    manifest.update({'thumbnail': self._put_object(encoded.tobytes()), 'face': face})
+        _write_durably(self._manifest_path(roll), json.dumps(manifest).encode())
+        logger.debug(f"✅ Reference image saved for {roll} ({len(image_bytes)} bytes)")
+
+    def _put_object(self, data):
+        # Named after the SHA-256 of the bytes, so the same upload is stored once and a file
+        # never changes after it is written
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            _write_durably(path, data)
+        return digest
+
+    def _object_path(self, digest):
+        return os.path.join(self.folder, 'objects', digest[:2], f'{digest}.jpg')
+
+    def _manifest_path(self, roll):
+        # One small manifest per student names their photo, thumbnail and the face inside it
+        return os.path.join(self.folder, 'refs', re.sub(r'[^A-Za-z0-9_.-]', '_', roll) + '.json')
+
+    def manifest(self, roll):
+        try:
+            with open(self._manifest_path(roll)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def reference(self, roll):
+        """The reference photo's bytes, or None"""
+        manifest = self.manifest(roll)
+        # Photos saved before the content-addressed layout live at uploads/{roll}.jpg
+        path = self._object_path(manifest['reference']) if manifest else os.path.join(self.folder, f'{roll}.jpg')
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def thumbnail(self, roll, color=True):
+        """(thumbnail image, face box inside it) for `roll`, or None without one"""
+        # Re-embedding reads these instead of decoding and detecting full frames
+        manifest = self.manifest(roll)
+        if not manifest or 'thumbnail' not in manifest:
+            return None
+        image = cv2.imread(self._object_path(manifest['thumbnail']), cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+        return image, tuple(manifest['face'])
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+
+def _percentage(part, whole):
+    return round(100.0 * part / whole, 1) if whole else 0.0
+
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day)
+
+
+def daily_report(store, day):
+    """Present/absent summary and the day's attendance records"""
+    start = _day_start(day)
+    records, seen = [], set()
+    for record in store.attendance_between(start, start + timedelta(days=1)):
+        # Keep each student's first mark of the day
+        if record['roll'] in seen:
+            continue
+        seen.add(record['roll'])
+        records.append({
+            'roll': record['roll'],
+            'name': record.get('name', ''),
+            'time': record['timestamp'].strftime('%H:%M:%S'),
+            'status': record.get('status', 'present')
+        })
+
+    total = store.count_students()
+    return {
+        'date': start.strftime('%Y-%m-%d'),
+        'total_students': total,
+        'present': len(records),
+        'absent': max(total - len(records), 0),
+        'attendance_percentage': _percentage(len(records), total),
+        'records': records
+    }
+
+
+def monthly_report(store, year, month):
+    """Per-day present counts and per-student attendance % for one month"""
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    summary = store.attendance_summary(start, end)
+    total = store.count_students()
+    class_days = len(summary['by_day'])
+
+    # Students who never showed up this month still belong in the report
+    present = {student['roll']: student for student in summary['by_student']}
+    students = []
+    for student in store.iter_students():
+        days_present = present.pop(student['roll'], {}).get('days_present', 0)
+        students.append({'roll': student['roll'], 'name': student.get('name', ''), 'days_present': days_present})
+    students.extend(present.values())
+
+    return {
+        'month': start.strftime('%Y-%m'),
+        'total_students': total,
+        'class_days': class_days,
+        'days': [
+            {'date': date, 'present': count, 'attendance_percentage': _percentage(count, total)}
+            for date, count in summary['by_day'].items()
+        ],
+        'students': [
+            dict(student, attendance_percentage=_percentage(student['days_present'], class_days))
+            for student in students
+        ]
+    }
+
+
+def student_report(store, roll, start, end):
+    """Days present and attendance % for one student over [start, end)"""
+    start_day, end_day = _day_start(start), _day_start(end)
+    class_days = len(store.attendance_days(start_day, end_day))
+    days_present = len(store.attendance_days(start_day, end_day, roll=roll))
+    return {
+        'roll': roll,
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'class_days': class_days,
+        'days_present': days_present,
+        'attendance_percentage': _percentage(days_present, class_days)
+    }
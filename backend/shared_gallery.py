@@ -0,0 +1,210 @@
+"""Face gallery shared by every gunicorn worker through memory-mapped files"""
+import fcntl
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from gallery import FaceGallery
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'gallery.json'
+LOCK_NAME = 'gallery.lock'
+
+
+class SharedFaceGallery(FaceGallery):
+    """A FaceGallery whose matrix lives in files shared by all processes.
+
+    Changes go through `add`, `load` and `update` as usual; they are written
+    under an exclusive flock and published as a new version, which this
+    process attaches to straight away and others pick up in `refresh`.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.-]', '_', self.model))
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_path = os.path.join(self.directory, INDEX_NAME)
+        self.lock_path = os.path.join(self.directory, LOCK_NAME)
+        self.version = 0
+        self._files = None  # (matrix, owners) file names of the attached version
+        self._index_stat = None
+
+    def refresh(self):
+        """Swap to the newest published version; returns True if it changed"""
+        try:
+            stat = os.stat(self.index_path)
+            key = (stat.st_ino, stat.st_mtime_ns)
+            if key == self._index_stat:
+                return False
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index['model'] != self.model or index['dim'] != self.dim or index['version'] == self.version:
+                self._index_stat = key
+                return False
+            self._attach(index)
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            # No gallery published yet, or files of a version superseded while we read it
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"⚠️ Could not attach shared face gallery: {e}")
+            return False
+        self._index_stat = key
+        return True
+
+    def load(self, students, generation=None, source=None):
+        with self._locked():
+            self.refresh()
+            if self.loaded and self.generation == generation and self.source == source:
+                return  # Another worker published this generation first
+            super().load(students, generation, source)
+            self._publish([], compact=True)
+            logger.info(f"📤 Published shared face gallery v{self.version}: {self._size} templates")
+
+    def update(self, students, generation=None):
+        changes = []
+        for student in students:
+            encodings = self._student_encodings(student)
+            if encodings is not None:
+                changes.append((student['roll'], student['name'], encodings))
+        with self._locked():
+            self.refresh()
+            if generation is not None and self.generation is not None and self.generation >= generation:
+                return 0  # Already published by another worker
+            self._publish(changes, generation)
+        return len(changes)
+
+    def _put(self, roll, name, encodings):
+        with self._locked():
+            self.refresh()
+            self._publish([(roll, name, encodings)])
+
+    def _attach(self, index):
+        # Mapped read-only, so the page cache holds one copy however many workers run
+        matrix = np.load(os.path.join(self.directory, index['matrix']), mmap_mode='r')
+        owners = np.load(os.path.join(self.directory, index['owners']), mmap_mode='r')
+        size = index['size']
+        rolls, names = index['rolls'], index['names']
+        rows, free = [[] for _ in rolls], []
+        for row, owner in enumerate(owners[:size].tolist()):
+            (rows[owner] if owner >= 0 else free).append(row)
+
+        with self._lock:
+            same_matrix = self._files is not None and self._files[0] == index['matrix']
+            old_size = self._size
+            self._buffer = matrix
+            self._owners = owners
+            self._size = size
+            self._index = {roll: student for student, roll in enumerate(rolls)}
+            self._rows = rows
+            self._free = free
+            self.rolls = rolls
+            self.names = names
+            self.generation = index['generation']
+            self.source = index['source']
+            self.version = index['version']
+            self._files = (index['matrix'], index['owners'])
+            self.loaded = True
+            if self.ann is not None:
+                if same_matrix:
+                    # Rows are append-only, so the index only needs the new ones
+                    self.ann.add(np.arange(old_size, size), np.asarray(matrix[old_size:size]))
+                else:
+                    self.ann = None
+
+    def _publish(self, changes, generation=None, compact=False):
+        """Write `changes` as the next version and attach to it; call with the lock held"""
+        # Published rows never change: new templates are appended past the published size
+        # and a student's old rows are only marked free
+        rolls, names = list(self.rolls), list(self.names)
+        index = dict(self._index)
+        owners = np.array(self.owners, dtype=np.int32)
+        blocks = []
+        for roll, name, encodings in changes:
+            student = index.get(roll)
+            if student is None:
+                student = index[roll] = len(rolls)
+                rolls.append(roll)
+                names.append(name)
+            elif student < len(self._rows):
+                old_rows = self._rows[student]
+                if names[student] == name and np.array_equal(self._buffer[old_rows], encodings):
+                    continue  # Unchanged, e.g. the sync after this worker's own add
+                names[student] = name
+                owners[old_rows] = -1
+            blocks.append((student, np.asarray(encodings, dtype=np.float32)))
+        if not blocks and not compact and generation is None:
+            return
+
+        added = sum(len(encodings) for _, encodings in blocks)
+        live = np.flatnonzero(owners >= 0)
+        version = self.version + 1
+        matrix_name = self._files[0] if self._files else None
+        if compact or matrix_name is None or len(owners) + added > self._buffer.shape[0] or len(live) < len(owners) // 2:
+            # Compact the live rows into a new file when the matrix is full or mostly freed
+            # rows; never rewrite one other processes may have mapped
+            matrix_name = f'matrix-{version}-{uuid.uuid4().hex[:8]}.npy'
+            matrix = np.lib.format.open_memmap(
+                os.path.join(self.directory, matrix_name), mode='w+',
+                dtype=np.float32, shape=(max(64, 2 * (len(live) + added)), self.dim)
+            )
+            matrix[:len(live)] = self._buffer[live]
+            owners = owners[live]
+        else:
+            matrix = np.load(os.path.join(self.directory, matrix_name), mmap_mode='r+')
+
+        size = len(owners)
+        owner_blocks = [owners]
+        for student, encodings in blocks:
+            matrix[size:size + len(encodings)] = encodings
+            owner_blocks.append(np.full(len(encodings), student, dtype=np.int32))
+            size += len(encodings)
+        matrix.flush()
+        del matrix
+
+        owners_name = f'owners-{version}-{uuid.uuid4().hex[:8]}.npy'
+        np.save(os.path.join(self.directory, owners_name), np.concatenate(owner_blocks))
+        published = {
+            'version': version,
+            'model': self.model,
+            'dim': self.dim,
+            'matrix': matrix_name,
+            'owners': owners_name,
+            'size': size,
+            'generation': self.generation if generation is None else generation,
+            'source': self.source,
+            'rolls': rolls,
+            'names': names
+        }
+        # Other workers swap to the new index on their next refresh; the rename makes sure
+        # they never read a half-written one
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(published, f)
+        os.replace(temp_path, self.index_path)
+
+        previous = self._files or ()
+        self._attach(published)
+        self._remove_stale_files(set(self._files) | set(previous))
+
+    def _remove_stale_files(self, keep):
+        # The previous version's files stay for workers that read its index a moment ago
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,862 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from gallery import PIXEL_MODEL
+
+logger = logging.getLogger(__name__)
+
+# While MongoDB is unreachable, how often (seconds) a request may try to reconnect
+MONGO_RETRY_INTERVAL = float(os.environ.get('MONGO_RETRY_INTERVAL', 30))
+
+# A students generation still missing after this many seconds belongs to a writer that died
+# before inserting it (or could not record its failure); syncs stop waiting for it
+GENERATION_GAP_TIMEOUT = float(os.environ.get('GENERATION_GAP_TIMEOUT', 60))
+
+# Version 1 stored `encodings` as lists of Python ints; version 2 stores raw bytes
+ENCODING_SCHEMA_VERSION = 2
+
+
+def pack_encodings(encodings, model=PIXEL_MODEL):
+    """Return the document fields for a stack of encodings stored as compact binary"""
+    encodings = np.ascontiguousarray(encodings)
+    if encodings.dtype != np.float32:
+        encodings = encodings.astype(np.uint8)
+    encodings = encodings.reshape(-1, encodings.shape[-1])
+    return {
+        'encoding': Binary(encodings.tobytes()),
+        'encoding_dtype': encodings.dtype.str,
+        'encoding_dim': encodings.shape[1],
+        'encoding_model': model,
+        'schema_version': ENCODING_SCHEMA_VERSION
+    }
+
+
+def unpack_encodings(student):
+    """Return a student's encodings as an (n, dim) array, zero-copy for binary documents"""
+    if 'encoding' in student:
+        data = np.frombuffer(student['encoding'], dtype=np.dtype(student['encoding_dtype']))
+        return data.reshape(-1, student['encoding_dim'])
+    # Legacy list-of-ints documents
+    return np.asarray(student.get('encodings') or [], dtype=np.uint8)
+
+
+def parse_timestamp(value):
+    """Return an attendance timestamp as a naive datetime, or None"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_timestamp(value):
+    """Serialize datetimes the way attendance timestamps have always been written to JSON"""
+    if isinstance(value, datetime):
+        return value.isoformat() + 'Z'
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def summarize_attendance(records):
+    """Group attendance records into present counts per day and per student"""
+    seen = set()
+    by_day, by_student = {}, {}
+    for record in records:
+        timestamp = parse_timestamp(record.get('timestamp'))
+        date = record.get('date') or (timestamp.strftime('%Y-%m-%d') if timestamp else None)
+        roll = record.get('roll')
+        if date is None or (roll, date) in seen:
+            continue
+        seen.add((roll, date))
+        by_day[date] = by_day.get(date, 0) + 1
+        student = by_student.setdefault(roll, {'roll': roll, 'name': record.get('name', ''), 'days_present': 0})
+        student['days_present'] += 1
+    return {'by_day': dict(sorted(by_day.items())), 'by_student': sorted(by_student.values(), key=lambda s: str(s['roll']))}
+
+
+def _timestamp_key(record):
+    timestamp = record.get('timestamp')
+    return timestamp if isinstance(timestamp, datetime) else datetime.min
+
+
+def _with_encodings(student):
+    student['encodings'] = unpack_encodings(student)
+    for field in ('encoding', 'encoding_dtype', 'encoding_dim'):
+        student.pop(field, None)
+    return student
+
+
+class MongoStore:
+    """Student and attendance repository backed by MongoDB.
+
+    Every query passes an explicit projection, so metadata lookups never
+    pull encodings over the wire.
+    """
+
+    STUDENT_PROJECTION = {'_id': 0, 'roll': 1, 'name': 1, 'registered_at': 1}
+    LISTING_PROJECTION = dict(
+        STUDENT_PROJECTION,
+        # Legacy documents only have the list, so size it server-side
+        encoding_dim={'$ifNull': ['$encoding_dim', {'$size': {'$ifNull': [{'$arrayElemAt': ['$encodings', 0]}, []]}}]}
+    )
+    # Records written before the date field existed are dated by their timestamp
+    ATTENDANCE_DATE = {'$ifNull': ['$date', {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}]}
+    ATTENDANCE_PROJECTION = {'_id': 0, 'roll': 1, 'name': 1, 'date': 1, 'timestamp': 1, 'status': 1}
+    GALLERY_PROJECTION = {
+        '_id': 0, 'roll': 1, 'name': 1, 'generation': 1,
+        'encodings': 1, 'encoding': 1, 'encoding_dtype': 1, 'encoding_dim': 1, 'encoding_model': 1
+    }
+
+    def __init__(self, db):
+        self.db = db
+        self.students = db['students']
+        self.attendance = db['attendance']
+        self.counters = db['counters']
+        self._gaps = {}  # Missing generation -> when a sync first waited for it
+
+    def ensure_indexes(self):
+        """Create the indexes the queries below rely on (idempotent)"""
+        indexes = [
+            (self.students, [('roll', ASCENDING)], {'unique': True}),
+            (self.students, [('generation', ASCENDING)], {}),
+            (self.attendance, [('timestamp', ASCENDING)], {}),
+            (self.attendance, [('roll', ASCENDING), ('timestamp', ASCENDING)], {}),
+            (self.attendance, [('roll', ASCENDING), ('date', ASCENDING)], {
+                'unique': True,
+                # Records written before the date field existed can't collide
+                'partialFilterExpression': {'date': {'$exists': True}}
+            }),
+        ]
+        for collection, keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except PyMongoError as e:
+                logger.warning(f"⚠️ Could not create index {keys} on {collection.name}: {e}")
+
+    # Students
+
+    def find_student(self, roll):
+        return self.students.find_one({'roll': roll}, self.STUDENT_PROJECTION)
+
+    def count_students(self):
+        return self.students.count_documents({})
+
+    def iter_students(self, with_encodings=False, roll=None, batch_size=1000):
+        query = {'roll': roll} if roll else {}
+        if with_encodings:
+            projection = {key: value for key, value in self.GALLERY_PROJECTION.items() if key != 'generation'}
+            students = self.students.find(query, dict(projection, registered_at=1)).batch_size(batch_size)
+            return (_with_encodings(student) for student in students)
+        return self.students.find(query, self.LISTING_PROJECTION).sort('roll', ASCENDING).batch_size(batch_size)
+
+    def add_student(self, student, encodings, model=PIXEL_MODEL):
+        """Insert a student with one or more encodings, stamping it with the next students generation"""
+        student = dict(student, **pack_encodings(encodings, model))
+        generation = self._next_generation()
+        student['generation'] = generation
+        try:
+            self.students.insert_one(student)
+        except PyMongoError:
+            # Tell gallery syncs this generation will never appear
+            self.counters.update_one({'_id': 'students'}, {'$addToSet': {'skipped': generation}})
+            raise
+
+    def add_encodings(self, roll, encodings, max_templates=None, model=PIXEL_MODEL, replace=False):
+        """Append encodings to a student's stack, keeping the newest `max_templates`.
+
+        Encodings from another model (or all of them, with `replace`) are
+        replaced rather than appended to. Returns the number of stored
+        encodings, or None if the student does not exist. The write is
+        conditional on the generation read, so concurrent appends to the same
+        student retry instead of overwriting each other.
+        """
+        projection = {key: value for key, value in self.GALLERY_PROJECTION.items() if key != 'roll'}
+        encodings = np.asarray(encodings)
+        for _ in range(3):
+            student = self.students.find_one({'roll': roll}, projection)
+            if student is None:
+                return None
+            stacked = encodings.reshape(-1, encodings.shape[-1])
+            if not replace and student.get('encoding_model', PIXEL_MODEL) == model:
+                existing = unpack_encodings(student)
+                if existing.size:
+                    stacked = np.vstack([existing, stacked.astype(existing.dtype)])
+            if max_templates:
+                stacked = stacked[-max_templates:]
+
+            # The rewrite retires the student's old generation, so syncs must not wait for it
+            generation = self._next_generation(supersedes=student.get('generation'))
+            result = self.students.update_one(
+                {'roll': roll, 'generation': student.get('generation')},
+                {'$set': dict(pack_encodings(stacked, model), generation=generation), '$unset': {'encodings': ''}}
+            )
+            if result.modified_count:
+                return len(stacked)
+            self.counters.update_one({'_id': 'students'}, {'$addToSet': {'skipped': generation}})
+        raise PyMongoError(f"Student {roll} is being updated concurrently, try again")
+
+    def students_generation(self):
+        """Return a token that changes whenever any process changes the student set"""
+        counter = self.counters.find_one({'_id': 'students'}, {'generation': 1})
+        return counter['generation'] if counter else 0
+
+    def gallery_students(self):
+        """Return (students with encodings, generation) for a full gallery load"""
+        generation = self.students_generation()
+        students = self.students.find({}, self.GALLERY_PROJECTION)
+        return (_with_encodings(student) for student in students), generation
+
+    def students_since(self, seen):
+        """Return (students changed after generation `seen`, new generation)"""
+        counter = self.counters.find_one({'_id': 'students'}) or {}
+        generation = counter.get('generation', 0)
+        changed = [
+            _with_encodings(student)
+            for student in self.students.find({'generation': {'$gt': seen}}, self.GALLERY_PROJECTION)
+        ]
+        # Generations come from an atomic counter, so a gap that was neither skipped nor
+        # superseded by a rewrite is a write still in progress; stop just before it
+        # so the next sync picks it up
+        found = {student.get('generation') for student in changed} | set(counter.get('skipped', []))
+        missing = [g for g in range(seen + 1, generation + 1) if g not in found]
+        now = time.monotonic()
+        self._gaps = {g: self._gaps.get(g, now) for g in missing}
+        orphaned = [g for g in missing if now - self._gaps[g] >= GENERATION_GAP_TIMEOUT]
+        if orphaned:
+            logger.warning(f"⚠️ Students generations {orphaned} never arrived, no longer waiting for them")
+            try:
+                self.counters.update_one({'_id': 'students'}, {'$addToSet': {'skipped': {'$each': orphaned}}})
+            except PyMongoError as e:
+                logger.warning(f"⚠️ Could not record skipped generations: {e}")
+            missing = [g for g in missing if g not in orphaned]
+        return changed, missing[0] - 1 if missing else generation
+
+    def migrate_encodings(self, batch_size=500):
+        """Convert legacy list-of-ints encodings to binary; returns the number migrated"""
+        migrated = 0
+        operations = []
+        legacy = self.students.find({'encoding': {'$exists': False}, 'encodings': {'$exists': True}})
+        for student in legacy.batch_size(batch_size):
+            encodings = unpack_encodings(student)
+            if encodings.size == 0:
+                continue
+            operations.append(UpdateOne(
+                {'_id': student['_id']},
+                {'$set': pack_encodings(encodings), '$unset': {'encodings': ''}}
+            ))
+            if len(operations) >= batch_size:
+                migrated += self.students.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            migrated += self.students.bulk_write(operations, ordered=False).modified_count
+        return migrated
+
+    def _next_generation(self, supersedes=None):
+        """Allocate the next students generation, marking `supersedes` as never coming back"""
+        update = {'$inc': {'generation': 1}}
+        if supersedes is not None:
+            update['$addToSet'] = {'skipped': supersedes}
+        counter = self.counters.find_one_and_update(
+            {'_id': 'students'},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['generation']
+
+    # Attendance
+
+    def iter_attendance(self, start=None, end=None, roll=None, newest_first=False, batch_size=1000):
+        """Cursor over attendance records, optionally filtered to [start, end) and one roll"""
+        query = {}
+        if start is not None or end is not None:
+            query['timestamp'] = {}
+            if start is not None:
+                query['timestamp']['$gte'] = start
+            if end is not None:
+                query['timestamp']['$lt'] = end
+        if roll:
+            query['roll'] = roll
+        cursor = self.attendance.find(query, self.ATTENDANCE_PROJECTION).batch_size(batch_size)
+        if newest_first:
+            cursor = cursor.sort('timestamp', DESCENDING)
+        return cursor
+
+    def attendance_rolls(self, date):
+        return set(self.attendance.distinct('roll', {'date': date}))
+
+    def attendance_between(self, start, end):
+        """Attendance records with start <= timestamp < end, oldest first"""
+        return self.iter_attendance(start, end).sort('timestamp', ASCENDING)
+
+    def attendance_summary(self, start, end):
+        """Present counts per day and per student between start and end, computed server-side"""
+        pipeline = [
+            {'$match': {'timestamp': {'$gte': start, '$lt': end}}},
+            # Count each student at most once per day, including pre-dedup legacy records
+            {'$group': {
+                '_id': {'roll': '$roll', 'date': self.ATTENDANCE_DATE},
+                'name': {'$first': '$name'}
+            }},
+            {'$facet': {
+                'by_day': [
+                    {'$group': {'_id': '$_id.date', 'present': {'$sum': 1}}},
+                    {'$sort': {'_id': 1}}
+                ],
+                'by_student': [
+                    {'$group': {'_id': '$_id.roll', 'name': {'$first': '$name'}, 'days_present': {'$sum': 1}}},
+                    {'$sort': {'_id': 1}}
+                ]
+            }}
+        ]
+        result = next(self.attendance.aggregate(pipeline), {'by_day': [], 'by_student': []})
+        return {
+            'by_day': {day['_id']: day['present'] for day in result['by_day']},
+            'by_student': [
+                {'roll': student['_id'], 'name': student['name'], 'days_present': student['days_present']}
+                for student in result['by_student']
+            ]
+        }
+
+    def attendance_days(self, start, end, roll=None):
+        """Sorted dates with any attendance between start and end (only `roll`'s, if given)"""
+        query = {'timestamp': {'$gte': start, '$lt': end}}
+        if roll:
+            query['roll'] = roll  # Served by the (roll, timestamp) index
+        pipeline = [{'$match': query}, {'$group': {'_id': self.ATTENDANCE_DATE}}, {'$sort': {'_id': 1}}]
+        return [day['_id'] for day in self.attendance.aggregate(pipeline)]
+
+    def migrate_timestamps(self, batch_size=500):
+        """Convert legacy ISO-string attendance timestamps to native dates"""
+        migrated = 0
+        operations = []
+        legacy = self.attendance.find({'timestamp': {'$type': 'string'}}, {'timestamp': 1})
+        for record in legacy.batch_size(batch_size):
+            timestamp = parse_timestamp(record['timestamp'])
+            if timestamp is None:
+                continue
+            operations.append(UpdateOne({'_id': record['_id']}, {'$set': {'timestamp': timestamp}}))
+            if len(operations) >= batch_size:
+                migrated += self.attendance.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            migrated += self.attendance.bulk_write(operations, ordered=False).modified_count
+        return migrated
+
+    def upsert_attendance(self, records):
+        """Insert records that don't already exist for their (roll, date)"""
+        operations = [
+            UpdateOne({'roll': record['roll'], 'date': record['date']}, {'$setOnInsert': record}, upsert=True)
+            for record in records
+        ]
+        return self.attendance.bulk_write(operations, ordered=False).upserted_count
+
+
+class LocalStore:
+    """File-based repository used when MongoDB is unavailable.
+
+    Student metadata and attendance are append-only JSONL logs, and face
+    encodings are rows of a memory-mapped .npy matrix (one per embedding
+    model) referenced by each student's `rows`. Writers take an exclusive flock so several
+    gunicorn workers can share the files. Each process tails the logs from
+    the last byte offset it read instead of re-parsing them.
+    """
+
+    STUDENTS_FILE = 'local_students.jsonl'
+    ATTENDANCE_FILE = 'local_attendance.jsonl'
+
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.students_path = os.path.join(directory, self.STUDENTS_FILE)
+        self.attendance_path = os.path.join(directory, self.ATTENDANCE_FILE)
+        self.encodings_path = os.path.join(directory, 'local_encodings.npy')
+        self.lock_path = os.path.join(directory, 'local_store.lock')
+        self._students = {}
+        self._students_offset = 0
+        self._attendance = set()
+        self._attendance_offset = 0
+        self._encodings = {}  # model -> (memory-mapped matrix, inode of its file)
+        self._inodes = {}  # log path -> inode of the file the offsets refer to
+        self._migrate_legacy(directory)
+
+    # Students
+
+    def find_student(self, roll):
+        self._refresh_students()
+        return self._students.get(roll)
+
+    def count_students(self):
+        self._refresh_students()
+        return len(self._students)
+
+    def iter_students(self, with_encodings=False, roll=None):
+        self._refresh_students()
+        if roll:
+            students = [self._students[roll]] if roll in self._students else []
+        else:
+            # Sorted by roll like MongoStore's listing, not in log order
+            students = sorted(self._students.values(), key=lambda student: str(student['roll']))
+        for stored in students:
+            student = {key: value for key, value in stored.items() if key not in ('row', 'rows')}
+            if with_encodings:
+                student['encodings'] = self._student_encodings(stored)
+            else:
+                student['encoding_dim'] = self._matrix(stored.get('encoding_model', PIXEL_MODEL)).shape[1]
+            yield student
+
+    def add_student(self, student, encodings, model=PIXEL_MODEL):
+        """Append a student; raises DuplicateKeyError for a known roll, as MongoStore's unique index does"""
+        with self._locked():
+            self._refresh_students()
+            if student['roll'] in self._students:
+                raise DuplicateKeyError(f"Student {student['roll']} already exists")
+            rows = self._append_encodings(encodings, model)
+            self._append_lines(self.students_path, [dict(
+                student, rows=rows, encoding_model=model, schema_version=ENCODING_SCHEMA_VERSION
+            )])
+
+    def add_encodings(self, roll, encodings, max_templates=None, model=PIXEL_MODEL, replace=False):
+        """Append (or with `replace`, swap in) encodings; returns the stored count or None if unknown"""
+        with self._locked():
+            self._refresh_students()
+            stored = self._students.get(roll)
+            if stored is None:
+                return None
+            rows = self._append_encodings(encodings, model)
+            if not replace and stored.get('encoding_model', PIXEL_MODEL) == model:
+                rows = self._student_rows(stored) + rows
+            if max_templates:
+                rows = rows[-max_templates:]
+            # A later line for the same roll supersedes the earlier one
+            student = {key: value for key, value in stored.items() if key != 'row'}
+            self._append_lines(self.students_path, [dict(student, rows=rows, encoding_model=model)])
+        return len(rows)
+
+    def students_generation(self):
+        try:
+            return os.path.getsize(self.students_path)
+        except FileNotFoundError:
+            return 0
+
+    def gallery_students(self):
+        return self.students_since(0)
+
+    def students_since(self, offset):
+        """Return (students appended after byte `offset`, new offset)"""
+        students, offset = self._read_lines(self.students_path, offset)
+        for student in students:
+            student['encodings'] = self._student_encodings(student)
+            student.pop('row', None)
+            student.pop('rows', None)
+        return students, offset
+
+    # Attendance
+
+    def iter_attendance(self, start=None, end=None, roll=None, newest_first=False):
+        records = self._scan_attendance(start, end, roll)
+        if newest_first:
+            # The log is in write order; only the filtered records are held for sorting
+            return iter(sorted(records, key=_timestamp_key, reverse=True))
+        return records
+
+    def attendance_rolls(self, date):
+        self._refresh_attendance()
+        return {roll for roll, marked_date in self._attendance if marked_date == date}
+
+    def attendance_between(self, start, end):
+        return sorted(self._scan_attendance(start, end), key=lambda record: record['timestamp'])
+
+    def attendance_summary(self, start, end):
+        return summarize_attendance(self.attendance_between(start, end))
+
+    def attendance_days(self, start, end, roll=None):
+        return list(summarize_attendance(self._scan_attendance(start, end, roll))['by_day'])
+
+    def upsert_attendance(self, records):
+        with self._locked():
+            # Another process may have marked the same students already
+            self._refresh_attendance()
+            new_records = [r for r in records if (r['roll'], r['date']) not in self._attendance]
+            self._append_lines(self.attendance_path, new_records)
+        return len(new_records)
+
+    def _scan_attendance(self, start=None, end=None, roll=None):
+        """Stream the attendance log, parsing timestamps and applying filters"""
+        if not os.path.exists(self.attendance_path):
+            return
+        with open(self.attendance_path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    continue
+                record = json.loads(line)
+                if roll and record.get('roll') != roll:
+                    continue
+                timestamp = parse_timestamp(record.get('timestamp'))
+                if timestamp is None:
+                    if start is not None or end is not None:
+                        continue
+                else:
+                    if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                        continue
+                    record['timestamp'] = timestamp
+                yield record
+
+    # Moving to another store
+
+    @classmethod
+    def has_data(cls, directory='.'):
+        """Whether students or attendance have been written to local files in `directory`"""
+        return any(os.path.exists(os.path.join(directory, name)) for name in (cls.STUDENTS_FILE, cls.ATTENDANCE_FILE))
+
+    def move_to(self, store, batch_size=1000):
+        """Copy every student and attendance record into `store`, then set the local files aside.
+
+        Holds the file lock throughout, so another process still writing
+        locally waits instead of writing something that would be left behind.
+        A roll `store` already has keeps its stored student. Copying again
+        after a failure is safe. Returns (students copied, records copied).
+        """
+        with self._locked():
+            # Read the files from the start, whatever this instance has seen so far
+            self._students, self._students_offset = {}, 0
+            students = 0
+            for stored in self.iter_students(with_encodings=True):
+                encodings = stored.pop('encodings')
+                model = stored.pop('encoding_model', PIXEL_MODEL)
+                stored.pop('schema_version', None)
+                try:
+                    store.add_student(stored, encodings, model=model)
+                    students += 1
+                except DuplicateKeyError:
+                    existing = store.find_student(stored['roll'])
+                    # The same registration is already there when an earlier copy was interrupted
+                    if existing is None or existing.get('registered_at') != stored.get('registered_at'):
+                        logger.warning(f"⚠️ Roll {stored['roll']} is registered in both stores; keeping the existing student")
+
+            records, batch = 0, []
+            for record in self._scan_attendance():
+                if 'date' not in record:
+                    if not isinstance(record.get('timestamp'), datetime):
+                        continue
+                    record['date'] = record['timestamp'].strftime('%Y-%m-%d')
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    records += store.upsert_attendance(batch)
+                    batch = []
+            if batch:
+                records += store.upsert_attendance(batch)
+
+            self._archive()
+        return students, records
+
+    def _archive(self):
+        """Rename the logs and encodings matrices so they are not copied again"""
+        suffix = '.moved-' + datetime.now().strftime('%Y%m%d%H%M%S')
+        names = [self.STUDENTS_FILE, self.ATTENDANCE_FILE] + [
+            name for name in os.listdir(self.directory) if name.startswith('local_encodings') and name.endswith('.npy')
+        ]
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.replace(path, path + suffix)
+        self._students, self._students_offset = {}, 0
+        self._attendance, self._attendance_offset = set(), 0
+        self._encodings = {}
+
+    # Files
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_lines(self, path, offset):
+        """Parse complete JSON lines after `offset`; returns (records, new offset)"""
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, 'rb') as f:
+            if offset > os.fstat(f.fileno()).st_size:
+                offset = 0  # A new file since `offset` was read (the old one was moved away)
+            f.seek(offset)
+            data = f.read()
+        # A writer may be mid-line; leave the partial tail for the next read
+        end = data.rfind(b'\n') + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, offset + end
+
+    def _append_lines(self, path, records):
+        if not records:
+            return
+        data = ''.join(json.dumps(record, default=format_timestamp) + '\n' for record in records)
+        with open(path, 'a') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replaced(self, path, offset):
+        """Whether `path` is no longer the file read up to `offset`, e.g. after another process's move_to"""
+        try:
+            stat = os.stat(path)
+            inode, size = stat.st_ino, stat.st_size
+        except FileNotFoundError:
+            inode, size = None, 0
+        previous = self._inodes.get(path, inode)
+        self._inodes[path] = inode
+        return previous != inode or size < offset
+
+    def _refresh_students(self):
+        if self._replaced(self.students_path, self._students_offset):
+            self._students, self._students_offset = {}, 0
+        students, self._students_offset = self._read_lines(self.students_path, self._students_offset)
+        for student in students:
+            self._students[student['roll']] = student
+
+    def _refresh_attendance(self):
+        if self._replaced(self.attendance_path, self._attendance_offset):
+            self._attendance, self._attendance_offset = set(), 0
+        records, self._attendance_offset = self._read_lines(self.attendance_path, self._attendance_offset)
+        self._attendance.update((record.get('roll'), record.get('date')) for record in records)
+
+    @staticmethod
+    def _student_rows(student):
+        # Students written before multi-encoding enrollment have a single `row`
+        return list(student['rows']) if 'rows' in student else [student['row']]
+
+    def _matrix_path(self, model):
+        if model == PIXEL_MODEL:
+            return self.encodings_path
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in model)
+        return os.path.join(os.path.dirname(self.encodings_path), f'local_encodings_{safe}.npy')
+
+    def _matrix(self, model, min_rows=0):
+        """The model's memory-mapped encodings matrix, reopened if it has grown past our view or been replaced"""
+        path = self._matrix_path(model)
+        inode = os.stat(path).st_ino
+        matrix, mapped = self._encodings.get(model, (None, None))
+        if matrix is None or mapped != inode or matrix.shape[0] < min_rows:
+            matrix = np.load(path, mmap_mode='r')
+            self._encodings[model] = (matrix, inode)
+        return matrix
+
+    def _student_encodings(self, student):
+        """Return a student's encodings as an (n, dim) array read from the memory-mapped matrix"""
+        rows = self._student_rows(student)
+        matrix = self._matrix(student.get('encoding_model', PIXEL_MODEL), max(rows) + 1)
+        if rows == list(range(rows[0], rows[0] + len(rows))):
+            return matrix[rows[0]:rows[0] + len(rows)]  # Zero-copy view
+        return matrix[rows]
+
+    def _append_encodings(self, encodings, model=PIXEL_MODEL):
+        """Append rows to the model's .npy matrix in place; returns their row numbers"""
+        path = self._matrix_path(model)
+        encodings = np.asarray(encodings)
+        # Pixel crops are stored as uint8, model embeddings as float32
+        dtype = np.float32 if encodings.dtype == np.float32 else np.uint8
+        block = np.ascontiguousarray(encodings, dtype=dtype).reshape(-1, encodings.shape[-1])
+        if not os.path.exists(path):
+            np.save(path, block)
+            return list(range(len(block)))
+
+        with open(path, 'r+b') as f:
+            np.lib.format.read_magic(f)
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            data_start = f.tell()
+            count = shape[0]
+            if block.shape[1] != shape[1]:
+                raise ValueError(f"Encodings have {block.shape[1]} values, {path} stores {shape[1]}")
+            block = block.astype(dtype, copy=False)
+            # Overwrite anything past the last committed row (e.g. a crashed append)
+            f.seek(data_start + count * block[0].nbytes)
+            f.write(block.tobytes())
+            f.truncate()
+            f.flush()
+
+            # numpy reserves header space for the growing axis, so it can be rewritten in place
+            header = BytesIO()
+            np.lib.format.write_array_header_1_0(header, {
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': False,
+                'shape': (count + len(block), block.shape[1])
+            })
+            if len(header.getvalue()) != data_start:
+                raise IOError(f"Cannot grow {path} in place")
+            f.seek(0)
+            f.write(header.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        return list(range(count, count + len(block)))
+
+    def _migrate_legacy(self, directory):
+        """Convert the old whole-file JSON stores into the append-only layout once"""
+        legacy_students = os.path.join(directory, 'local_students.json')
+        legacy_attendance = os.path.join(directory, 'local_attendance.json')
+        with self._locked():
+            if os.path.exists(legacy_students) and not os.path.exists(self.students_path):
+                with open(legacy_students, 'r') as f:
+                    students = json.load(f)
+                for student in students:
+                    encodings = student.pop('encodings', None)
+                    if not encodings:
+                        continue
+                    rows = self._append_encodings(encodings)
+                    self._append_lines(self.students_path, [dict(student, rows=rows, schema_version=ENCODING_SCHEMA_VERSION)])
+                os.replace(legacy_students, legacy_students + '.migrated')
+                logger.info(f"✅ Migrated {len(students)} students to {self.students_path}")
+
+            if os.path.exists(legacy_attendance) and not os.path.exists(self.attendance_path):
+                with open(legacy_attendance, 'r') as f:
+                    records = json.load(f)
+                self._append_lines(self.attendance_path, records)
+                os.replace(legacy_attendance, legacy_attendance + '.migrated')
+                logger.info(f"✅ Migrated {len(records)} attendance records to {self.attendance_path}")
+
+
+class LazyStore:
+    """Connects to MongoDB on first use rather than at import.
+
+    Until MongoDB answers, the local-file store stands in and a background
+    reconnect is attempted at most every `retry_interval` seconds, so a worker that started
+    during an outage switches to MongoDB once it is back. Whatever was written
+    to local files meanwhile is copied into MongoDB first. Everything else is
+    delegated to the current store. `backend` ('mongo' or 'local') tells
+    callers holding store-specific state, like generation tokens, when the
+    store underneath has changed.
+    """
+
+    def __init__(self, uri, database, timeout_ms=5000, retry_interval=MONGO_RETRY_INTERVAL):
+        self.uri = uri
+        self.database = database
+        self.timeout_ms = timeout_ms
+        self.retry_interval = retry_interval
+        self.client = None
+        self._store = None
+        self._retry_at = 0
+        self._attempt = 0  # Bumped by disconnect so a retry started before it is dropped
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        store = self._store
+        if store is None:
+            return self._connect()  # Nothing to serve from yet
+        if self.client is None and time.monotonic() >= self._retry_at:
+            self._retry_in_background()
+        return store
+
+    @property
+    def backend(self):
+        return 'mongo' if isinstance(self.current, MongoStore) else 'local'
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+    def _connect(self):
+        with self._lock:
+            if self._store is not None:
+                return self._store  # Another thread got here first
+            self._retry_at = time.monotonic() + self.retry_interval
+            try:
+                self.client, self._store = self._open()
+                logger.info("✅ MongoDB connected successfully")
+            except (PyMongoError, OSError, ValueError) as e:
+                logger.warning(f"⚠️ MongoDB connection failed: {e}")
+                logger.warning("📝 Will store data in local files for testing")
+                self._store = LocalStore()
+            return self._store
+
+    def _retry_in_background(self):
+        with self._lock:
+            if self.client is not None or time.monotonic() < self._retry_at:
+                return
+            # Claim this attempt; requests keep using the local files while it runs, since
+            # the ping can take `timeout_ms` and the copy below as long as the data needs
+            self._retry_at = time.monotonic() + self.retry_interval
+            attempt = self._attempt
+        threading.Thread(target=self._retry, args=(attempt,), daemon=True, name='mongo-reconnect').start()
+
+    def _retry(self, attempt):
+        try:
+            client, store = self._open()
+        except (PyMongoError, OSError, ValueError) as e:
+            logger.debug(f"MongoDB still unreachable: {e}")
+            return
+        with self._lock:
+            if attempt != self._attempt:
+                client.close()  # Disconnected meanwhile
+                return
+            self.client, self._store = client, store
+        logger.info("🔌 MongoDB is reachable again, switched from local files")
+
+    def _open(self):
+        """Connect, ping and copy over anything written to local files; returns (client, store)"""
+        client = MongoClient(self.uri, serverSelectionTimeoutMS=self.timeout_ms)
+        try:
+            client.admin.command('ping')
+            store = MongoStore(client[self.database])
+            store.ensure_indexes()
+            if LocalStore.has_data():
+                # Registrations and marks made during an outage would otherwise vanish from
+                # the gallery, reports and exports; a failed copy is retried on the next attempt
+                try:
+                    students, records = LocalStore().move_to(store)
+                except (PyMongoError, OSError, ValueError) as e:
+                    logger.error(f"❌ Could not copy local files to MongoDB, staying on them: {e}")
+                    raise
+                logger.warning(
+                    f"📤 Copied {students} students and {records} attendance records from local files to MongoDB"
+                )
+        except BaseException:
+            client.close()
+            raise
+        return client, store
+
+    def use(self, store):
+        """Pin an already built store (benchmarks, scripts) instead of connecting"""
+        with self._lock:
+            self._attempt += 1
+            self._store = store
+            self._retry_at = float('inf')
+
+    def disconnect(self):
+        """Close the connection (e.g. before gunicorn forks workers); the next use reconnects.
+
+        Without a connection the local files stay in use and the reconnect
+        runs in the background, so a worker forked during an outage does not
+        wait out the ping on its first request.
+        """
+        with self._lock:
+            self._attempt += 1
+            if self.client is not None:
+                self.client.close()
+            self._store = LocalStore() if self.client is None and isinstance(self._store, LocalStore) else None
+            self.client = None
+            self._retry_at = 0
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] != ['migrate']:
+        print("Usage: python storage.py migrate")
+        sys.exit(1)
+
+    # Convert documents written by older versions in place
+    client = MongoClient(os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'))
+    store = MongoStore(client[os.environ.get('DATABASE_NAME', 'ai_attendance')])
+    print(f"✅ Migrated {store.migrate_encodings()} students to binary encodings")
+    print(f"✅ Migrated {store.migrate_timestamps()} attendance timestamps to native dates")
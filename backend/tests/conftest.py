@@ -0,0 +1,41 @@
+import os
+import sys
+
+import mongomock
+import numpy as np
+import pytest
+
+# Backend modules import each other as top-level modules, as they do under gunicorn --chdir backend
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import LocalStore, MongoStore  # noqa: E402
+
+DIM = 16
+
+
+@pytest.fixture
+def mongo_store():
+    store = MongoStore(mongomock.MongoClient()['test'])
+    store.ensure_indexes()
+    return store
+
+
+@pytest.fixture
+def local_store(tmp_path):
+    return LocalStore(str(tmp_path))
+
+
+@pytest.fixture(params=['mongo', 'local'])
+def store(request, tmp_path):
+    if request.param == 'mongo':
+        return MongoStore(mongomock.MongoClient()['test'])
+    return LocalStore(str(tmp_path))
+
+
+def encodings(seed, count=1, dim=DIM):
+    """Reproducible uint8 encodings, as the pixel embedder stores them"""
+    return np.random.default_rng(seed).integers(0, 256, (count, dim), dtype=np.uint8)
+
+
+def student(roll, name=None):
+    return {'roll': roll, 'name': name or f'Student {roll}', 'registered_at': '2024-01-01T00:00:00Z'}
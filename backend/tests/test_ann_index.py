@@ -0,0 +1,30 @@
+import os
+
+import numpy as np
+
+import ann_index
+from gallery import FaceGallery
+from test_gallery import DIM, doc, faces
+
+
+def gallery_of(count):
+    gallery = FaceGallery(dim=DIM)
+    gallery.load([doc(f'S{i}', faces(i)) for i in range(count)])
+    return gallery
+
+
+def test_index_is_built_once_and_reloaded_by_other_workers(tmp_path, monkeypatch):
+    path = str(tmp_path / 'face_index.npz')
+    index = ann_index.load_or_build(gallery_of(64), path)
+    assert len(index) == 64
+    # The file was renamed into place: no temporary file is left behind
+    assert sorted(os.listdir(tmp_path)) == ['face_index.npz', 'face_index.npz.lock']
+
+    builds = []
+    monkeypatch.setattr(ann_index.IVFIndex, 'build', classmethod(lambda cls, *args, **kwargs: builds.append(args)))
+    other = gallery_of(64)
+    loaded = ann_index.load_or_build(other, path)
+    assert builds == [] and other.ann is loaded
+    probe = faces(5)[0]
+    assert other.best_match(probe)[0] == 'S5'
+    np.testing.assert_array_equal(loaded.search(probe), index.search(probe))
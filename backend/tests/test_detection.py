@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import detection
+
+
+class RecordingCascade:
+    """Stands in for the Haar cascade and remembers what it was asked to scan"""
+
+    def detectMultiScale(self, image, scaleFactor, minNeighbors, minSize, maxSize):
+        self.shape, self.min_size = image.shape, minSize
+        return np.empty((0, 4), dtype=int)
+
+
+@pytest.mark.parametrize('width', [640, 1280, 1920, 4032])
+def test_downscale_keeps_min_face_above_cascade_window(monkeypatch, width):
+    cascade = RecordingCascade()
+    monkeypatch.setattr(detection, 'face_cascade', cascade)
+    detection._detect_boxes(np.zeros((width * 3 // 4, width), dtype=np.uint8), min_face=48)
+
+    assert cascade.min_size[0] >= detection.CASCADE_WINDOW
+    assert cascade.shape[1] >= detection.DETECTION_MAX_WIDTH
+    assert cascade.shape[1] == max(round(width * detection.CASCADE_WINDOW / 48), detection.DETECTION_MAX_WIDTH)
+
+
+def test_small_frames_are_not_resized(monkeypatch):
+    cascade = RecordingCascade()
+    monkeypatch.setattr(detection, 'face_cascade', cascade)
+    detection._detect_boxes(np.zeros((240, 320), dtype=np.uint8), min_face=16)
+    assert cascade.shape == (240, 320)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from gallery import PIXEL_MODEL, FaceGallery
+
+DIM = 64
+
+
+def faces(seed, count=1):
+    return np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+
+
+def doc(roll, encodings, model=PIXEL_MODEL):
+    return {'roll': roll, 'name': f'Student {roll}', 'encodings': encodings, 'encoding_model': model}
+
+
+def test_update_replaces_a_students_rows_and_frees_the_rest():
+    a, b = faces(1, 3), faces(2)
+    gallery = FaceGallery(dim=DIM)
+    gallery.load([doc('A', a), doc('B', b)], generation=1)
+    assert gallery.best_match(a[2])[0] == 'A'
+
+    # A re-enrolled with a single new template: its three old rows go away
+    new_a = faces(3)
+    assert gallery.update([doc('A', new_a)], generation=2) == 1
+    assert gallery.generation == 2
+    assert len(gallery) == 2
+    assert gallery.template_rolls().count('A') == 1
+    assert gallery.template_rolls().count('') == 2
+    assert gallery.best_match(a[2]) is None
+    assert gallery.best_match(a[0]) is None
+    assert gallery.best_match(new_a[0])[0] == 'A'
+    assert gallery.best_matches(np.vstack([a[1], b[0]])) == [None, gallery.best_match(b[0])]
+
+
+def test_update_reuses_freed_rows_before_growing():
+    gallery = FaceGallery(dim=DIM)
+    gallery.load([doc('A', faces(1, 3))])
+    gallery.update([doc('A', faces(2))])
+    rows = gallery.matrix.shape[0]
+
+    c = faces(4, 2)
+    gallery.update([doc('C', c)])
+    assert gallery.matrix.shape[0] == rows
+    assert gallery.template_rolls().count('') == 0
+    assert all(gallery.best_match(template)[0] == 'C' for template in c)
+    assert gallery.top_matches(c, k=2)[0][0] == 'C'
+
+
+def test_update_adds_new_students_and_skips_other_models():
+    gallery = FaceGallery(dim=DIM)
+    gallery.load([doc('A', faces(1))], generation=1)
+    d = faces(5)
+    assert gallery.update([doc('D', d), doc('E', faces(6), model='other-model')], generation=2) == 1
+    assert 'D' in gallery and 'E' not in gallery
+    assert gallery.best_match(d[0])[0] == 'D'
+
+
+def test_load_keeps_the_last_copy_of_a_student():
+    """Append-only stores list a student again after an update"""
+    old, new = faces(1, 2), faces(2)
+    gallery = FaceGallery(dim=DIM)
+    gallery.load([doc('A', old), doc('A', new)])
+    assert len(gallery) == 1 and gallery.matrix.shape[0] == 1
+    assert gallery.best_match(old[0]) is None
+    assert gallery.best_match(new[0])[0] == 'A'
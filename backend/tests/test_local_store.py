@@ -0,0 +1,140 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from conftest import DIM, encodings, student
+from storage import LocalStore
+
+
+def mark(roll, day):
+    return {'roll': roll, 'name': f'Student {roll}', 'date': day, 'timestamp': datetime.fromisoformat(f'{day}T09:00:00'),
+            'status': 'present'}
+
+
+def test_logs_are_replayed_by_a_new_instance(tmp_path):
+    store = LocalStore(str(tmp_path))
+    store.add_student(student('A'), encodings(1, 2))
+    store.add_encodings('A', encodings(2))
+    store.add_student(student('B'), encodings(3))
+    store.upsert_attendance([mark('A', '2024-01-01'), mark('B', '2024-01-01')])
+
+    reopened = LocalStore(str(tmp_path))
+    assert reopened.count_students() == 2
+    assert reopened.find_student('A')['name'] == 'Student A'
+    # The later log line for A (three templates) supersedes the first one
+    stored = {s['roll']: s['encodings'] for s in reopened.iter_students(with_encodings=True)}
+    np.testing.assert_array_equal(stored['A'], np.vstack([encodings(1, 2), encodings(2)]))
+    assert reopened.attendance_rolls('2024-01-01') == {'A', 'B'}
+    # Marks already in the log are not written twice
+    assert reopened.upsert_attendance([mark('A', '2024-01-01'), mark('A', '2024-01-02')]) == 1
+
+
+def test_encodings_matrix_grows_and_is_reopened_by_another_instance(tmp_path):
+    writer = LocalStore(str(tmp_path))
+    reader = LocalStore(str(tmp_path))
+    writer.add_student(student('A'), encodings(1))
+    assert len(list(reader.iter_students(with_encodings=True))) == 1
+
+    # The reader's memory map only covers row 0; it must reopen to see row 1
+    writer.add_student(student('B'), encodings(2))
+    stored = {s['roll']: s['encodings'] for s in reader.iter_students(with_encodings=True)}
+    np.testing.assert_array_equal(stored['B'], encodings(2))
+    assert np.load(os.path.join(tmp_path, 'local_encodings.npy')).shape == (2, DIM)
+
+
+def test_legacy_json_stores_are_migrated_once(tmp_path):
+    legacy_students = [
+        {'roll': 'A', 'name': 'Student A', 'registered_at': '2024-01-01T00:00:00Z', 'encodings': encodings(1).tolist()}
+    ]
+    legacy_attendance = [{'roll': 'A', 'name': 'Student A', 'date': '2024-01-01',
+                          'timestamp': '2024-01-01T09:00:00Z', 'status': 'present'}]
+    with open(tmp_path / 'local_students.json', 'w') as f:
+        json.dump(legacy_students, f)
+    with open(tmp_path / 'local_attendance.json', 'w') as f:
+        json.dump(legacy_attendance, f)
+
+    store = LocalStore(str(tmp_path))
+    assert (tmp_path / 'local_students.json.migrated').exists()
+    assert (tmp_path / 'local_attendance.json.migrated').exists()
+    migrated = next(store.iter_students(with_encodings=True))
+    np.testing.assert_array_equal(migrated['encodings'], encodings(1))
+    assert store.attendance_rolls('2024-01-01') == {'A'}
+
+    # A second start finds nothing left to migrate
+    assert LocalStore(str(tmp_path)).count_students() == 1
+
+
+def test_students_are_listed_by_roll(local_store):
+    for roll in ['C', 'A', 'B']:
+        local_store.add_student(student(roll), encodings(ord(roll)))
+    local_store.add_encodings('A', encodings(9))
+    assert [s['roll'] for s in local_store.iter_students()] == ['A', 'B', 'C']
+
+
+def test_duplicate_roll_is_rejected(local_store):
+    local_store.add_student(student('A'), encodings(1))
+    with pytest.raises(DuplicateKeyError):
+        local_store.add_student(student('A', 'Someone else'), encodings(2))
+    assert local_store.find_student('A')['name'] == 'Student A'
+    # Nothing was appended for the rejected student
+    assert np.load(local_store.encodings_path).shape[0] == 1
+
+
+def test_move_to_copies_everything_and_sets_the_files_aside(tmp_path):
+    source_dir, target_dir = tmp_path / 'outage', tmp_path / 'target'
+    source_dir.mkdir()
+    target_dir.mkdir()
+    source = LocalStore(str(source_dir))
+    source.add_student(student('A'), encodings(1, 2))
+    source.add_student(student('B'), encodings(2))
+    source.upsert_attendance([mark('A', '2024-01-01'), mark('B', '2024-01-01')])
+    target = LocalStore(str(target_dir))
+    target.add_student(student('B', 'Registered elsewhere'), encodings(3))
+
+    assert LocalStore.has_data(str(source_dir))
+    assert LocalStore(str(source_dir)).move_to(target) == (1, 2)
+
+    stored = {s['roll']: s for s in target.iter_students(with_encodings=True)}
+    np.testing.assert_array_equal(stored['A']['encodings'], encodings(1, 2))
+    assert stored['B']['name'] == 'Registered elsewhere'
+    assert target.attendance_rolls('2024-01-01') == {'A', 'B'}
+    # The copied files are renamed, so the next reconnect has nothing to copy
+    assert not LocalStore.has_data(str(source_dir))
+    assert any(name.startswith('local_encodings.npy.moved-') for name in os.listdir(source_dir))
+
+
+def test_other_instances_follow_files_moved_away(tmp_path):
+    """Another worker's instance must notice the logs and matrix were replaced under it"""
+    source_dir, target_dir = tmp_path / 'outage', tmp_path / 'target'
+    source_dir.mkdir()
+    target_dir.mkdir()
+    mover = LocalStore(str(source_dir))
+    other = LocalStore(str(source_dir))
+    mover.add_student(student('A'), encodings(1, 2))
+    mover.add_student(student('B'), encodings(2))
+    mover.upsert_attendance([mark('A', '2024-01-01')])
+    assert other.count_students() == 2
+    assert other.attendance_rolls('2024-01-01') == {'A'}
+    next(other.iter_students(with_encodings=True))
+
+    mover.move_to(LocalStore(str(target_dir)))
+    other.add_student(student('C'), encodings(3))
+    other.upsert_attendance([mark('C', '2024-01-01')])
+
+    assert [s['roll'] for s in other.iter_students()] == ['C']
+    np.testing.assert_array_equal(next(other.iter_students(with_encodings=True))['encodings'], encodings(3))
+    assert other.attendance_rolls('2024-01-01') == {'C'}
+    changed, _ = other.students_since(1 << 20)
+    assert [s['roll'] for s in changed] == ['C']
+
+
+def test_encodings_of_another_width_are_rejected(local_store):
+    local_store.add_student(student('A'), encodings(1))
+    with pytest.raises(ValueError):
+        local_store.add_student(student('B'), encodings(2, dim=DIM + 1))
+    assert local_store.find_student('B') is None
+    assert np.load(local_store.encodings_path).shape == (1, DIM)
@@ -0,0 +1,30 @@
+import numpy as np
+
+import recognition_cache
+from recognition_cache import RecognitionCache
+
+BOX = (40, 40, 160, 160)
+
+
+def frame(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (60, 80), dtype=np.uint8)
+
+
+def test_recognized_result_expires_with_the_ttl(monkeypatch):
+    """A student who steps into the same spot later must be matched afresh"""
+    now = [100.0]
+    monkeypatch.setattr(recognition_cache.time, 'monotonic', lambda: now[0])
+    cache = RecognitionCache(ttl=1.0)
+    match = ('A', 'Student A', 0.9)
+    cache.put('session', frame(), BOX, match)
+
+    assert cache.get('session', frame(), BOX) == (BOX, match)
+    now[0] += 1.5
+    assert cache.get('session', frame(), BOX) is None
+
+
+def test_different_face_is_a_miss():
+    cache = RecognitionCache(ttl=10.0)
+    cache.put('session', frame(0), BOX, ('A', 'Student A', 0.9))
+    assert cache.get('session', frame(1), BOX) is None
+    assert cache.get('other', frame(0), BOX) is None
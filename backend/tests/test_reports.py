@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import reports
+from storage import LocalStore
+
+
+def add_marks(store, marks):
+    records = [
+        {'roll': roll, 'name': f'Student {roll}', 'date': day, 'timestamp': datetime.fromisoformat(f'{day}T09:00:00'),
+         'status': 'present'}
+        for roll, day in marks
+    ]
+    if isinstance(store, LocalStore):
+        store.upsert_attendance(records)
+    else:
+        store.attendance.insert_many(records)  # mongomock cannot run upsert_attendance's bulk write
+
+
+def test_student_report_counts_only_that_students_days(store):
+    add_marks(store, [('A', '2024-01-01'), ('B', '2024-01-01'), ('B', '2024-01-02'), ('A', '2024-01-03'),
+                      ('A', '2024-02-01')])
+    # A legacy record without a date is dated by its timestamp
+    if isinstance(store, LocalStore):
+        store._append_lines(store.attendance_path, [{'roll': 'B', 'timestamp': datetime(2024, 1, 4, 9)}])
+    else:
+        store.attendance.insert_one({'roll': 'B', 'timestamp': datetime(2024, 1, 4, 9)})
+
+    assert store.attendance_days(datetime(2024, 1, 1), datetime(2024, 2, 1)) == [
+        '2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04'
+    ]
+    report = reports.student_report(store, 'A', datetime(2024, 1, 1), datetime(2024, 2, 1))
+    assert report['class_days'] == 4
+    assert report['days_present'] == 2
+    assert report['attendance_percentage'] == 50.0
+    assert reports.student_report(store, 'C', datetime(2024, 1, 1), datetime(2024, 2, 1))['days_present'] == 0
@@ -0,0 +1,35 @@
+import numpy as np
+
+from gallery import FaceGallery
+from shared_gallery import SharedFaceGallery
+from test_gallery import DIM, doc, faces
+
+
+def test_reenrolled_student_still_matches_a_probe_close_to_the_old_template(tmp_path):
+    """Replaced rows stay in the shared matrix, so they must not win the argmax"""
+    old, new = faces(1), faces(2)
+    probe = old[0] + 0.2 * new[0]
+    results = []
+    for gallery in (FaceGallery(dim=DIM), SharedFaceGallery(str(tmp_path), dim=DIM)):
+        gallery.load([doc('A', old), doc('B', faces(3))], generation=1)
+        gallery.update([doc('A', np.vstack([new, old[0] + 0.5 * new[0]]))], generation=2)
+        results.append((gallery.best_match(probe, threshold=0.5), gallery.best_matches(probe, threshold=0.5)))
+
+    private, shared = results
+    assert private[0][0] == 'A'
+    assert shared == private
+
+
+def test_other_workers_see_a_reenrollment(tmp_path):
+    writer = SharedFaceGallery(str(tmp_path), dim=DIM)
+    reader = SharedFaceGallery(str(tmp_path), dim=DIM)
+    old, new = faces(1), faces(2)
+    writer.load([doc('A', old)], generation=1)
+    assert reader.refresh() and reader.best_match(old[0])[0] == 'A'
+
+    writer.update([doc('A', new)], generation=2)
+    assert reader.refresh()
+    assert reader.generation == 2
+    assert reader.template_rolls().count('A') == 1
+    assert reader.best_match(old[0]) is None
+    assert reader.best_match(new[0])[0] == 'A'
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import mongomock
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+
+import storage
+from conftest import DIM, encodings, student
+from gallery import FaceGallery
+
+
+def test_register_then_enroll_then_sync(mongo_store):
+    """A rewrite by add_encodings must not leave a gap that stalls later syncs"""
+    mongo_store.add_student(student('A'), encodings(1))
+    _, seen = mongo_store.gallery_students()
+
+    mongo_store.add_student(student('B'), encodings(2))
+    mongo_store.add_encodings('B', encodings(3))
+    changed, seen = mongo_store.students_since(seen)
+    assert [s['roll'] for s in changed] == ['B']
+    assert len(changed[0]['encodings']) == 2
+    assert seen == mongo_store.students_generation()
+
+    # Nothing changed since: the next sync is empty rather than re-reading B
+    changed, seen_again = mongo_store.students_since(seen)
+    assert changed == []
+    assert seen_again == seen
+
+
+def sync(store, seen):
+    changed, seen = store.students_since(seen)
+    return sorted(s['roll'] for s in changed), seen
+
+
+def test_interleaved_writes_are_each_synced_once(store):
+    """students_since hands every change to a worker exactly once, whatever the interleaving"""
+    store.add_student(student('A'), encodings(1))
+    _, seen = store.gallery_students()
+    assert seen == store.students_generation()
+
+    store.add_encodings('A', encodings(2))
+    store.add_student(student('B'), encodings(3))
+    store.add_encodings('A', encodings(4))
+    store.add_encodings('B', encodings(5))
+    rolls, seen = sync(store, seen)
+    assert set(rolls) == {'A', 'B'}
+    assert seen == store.students_generation()
+
+    store.add_student(student('C'), encodings(6))
+    store.add_encodings('B', encodings(7), max_templates=2)
+    rolls, seen = sync(store, seen)
+    assert set(rolls) == {'B', 'C'}
+    assert sync(store, seen) == ([], seen)
+
+    stored = {s['roll']: len(s['encodings']) for s in store.iter_students(with_encodings=True)}
+    assert stored == {'A': 3, 'B': 2, 'C': 1}
+
+
+def test_sync_waits_for_a_registration_still_being_written(mongo_store):
+    mongo_store.add_student(student('A'), encodings(1))
+    _, seen = mongo_store.gallery_students()
+
+    # B has its generation but is not inserted yet; C lands after it
+    pending = mongo_store._next_generation()
+    mongo_store.add_student(student('C'), encodings(2))
+    # C is applied now, but the sync point stays before B so B is not missed later
+    rolls, stopped = sync(mongo_store, seen)
+    assert rolls == ['C'] and stopped == pending - 1
+
+    mongo_store.students.insert_one(dict(student('B'), generation=pending))
+    rolls, seen = sync(mongo_store, stopped)
+    assert rolls == ['B', 'C']
+    assert seen == mongo_store.students_generation()
+
+
+def test_failed_registration_does_not_stall_sync(mongo_store):
+    mongo_store.add_student(student('A'), encodings(1))
+    _, seen = mongo_store.gallery_students()
+    try:
+        mongo_store.add_student(student('A'), encodings(2))
+    except DuplicateKeyError:
+        pass
+    mongo_store.add_student(student('B'), encodings(3))
+    assert sync(mongo_store, seen) == (['B'], mongo_store.students_generation())
+
+
+def test_gallery_follows_store_changes(store):
+    gallery = FaceGallery(dim=DIM)
+    store.add_student(student('A'), encodings(1, 3))
+    gallery.load(*store.gallery_students())
+
+    store.add_student(student('B'), encodings(2))
+    store.add_encodings('A', encodings(3), replace=True)
+    changed, generation = store.students_since(gallery.generation)
+    gallery.update(changed, generation)
+
+    assert gallery.generation == store.students_generation()
+    assert gallery.template_rolls().count('A') == 1
+    assert gallery.best_match(encodings(3)[0])[0] == 'A'
+    assert gallery.best_match(encodings(1, 3)[1]) is None
+    assert gallery.best_match(encodings(2)[0])[0] == 'B'
+
+
+def test_orphaned_generation_stops_stalling_sync_after_the_timeout(mongo_store, monkeypatch):
+    """A writer that died between allocating a generation and inserting must not pin the sync point"""
+    now = [100.0]
+    monkeypatch.setattr(storage.time, 'monotonic', lambda: now[0])
+    mongo_store.add_student(student('A'), encodings(1))
+    _, seen = mongo_store.gallery_students()
+
+    orphan = mongo_store._next_generation()
+    mongo_store.add_student(student('B'), encodings(2))
+    assert sync(mongo_store, seen) == (['B'], orphan - 1)
+
+    now[0] += storage.GENERATION_GAP_TIMEOUT
+    rolls, seen = sync(mongo_store, seen)
+    assert rolls == ['B'] and seen == mongo_store.students_generation()
+    assert sync(mongo_store, seen) == ([], seen)
+    # Other workers skip it straight away
+    assert orphan in mongo_store.counters.find_one({'_id': 'students'})['skipped']
+
+
+class FlakyClient:
+    """MongoClient stand-in whose ping fails while `down` and waits for `answer`"""
+    down = True
+    answer = None
+    db = None
+
+    def __init__(self, uri, **kwargs):
+        self.admin = self
+
+    def command(self, name):
+        FlakyClient.answer.wait(5)
+        if FlakyClient.down:
+            raise ServerSelectionTimeoutError('down')
+
+    def __getitem__(self, name):
+        return FlakyClient.db
+
+    def close(self):
+        pass
+
+
+def test_reconnect_runs_off_the_request_thread(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, 'MongoClient', FlakyClient)
+    FlakyClient.down, FlakyClient.answer = True, threading.Event()
+    FlakyClient.db = mongomock.MongoClient()['test']
+    FlakyClient.answer.set()
+    lazy = storage.LazyStore('mongodb://unreachable', 'test', retry_interval=0)
+    assert lazy.backend == 'local'
+    lazy.add_student(student('A'), encodings(1))
+    # Forked workers keep the local files rather than pinging on their first request
+    lazy.disconnect()
+    assert isinstance(lazy._store, storage.LocalStore)
+
+    # MongoDB is back but slow to answer: requests keep going to the local files meanwhile
+    FlakyClient.down, FlakyClient.answer = False, threading.Event()
+    assert lazy.backend == 'local'
+    assert lazy.find_student('A')['name'] == 'Student A'
+    FlakyClient.answer.set()
+    for _ in range(100):
+        if lazy.backend == 'mongo':
+            break
+        time.sleep(0.01)
+    assert lazy.backend == 'mongo'
+    assert lazy.find_student('A')['name'] == 'Student A'
+    assert not storage.LocalStore.has_data()
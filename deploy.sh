@@ -42,7 +42,7 @@ case $choice in
         echo "2. Connect GitHub to Render.com"
         echo "3. Create Web Service with these settings:"
         echo "   - Build Command: pip install -r backend/requirements.txt"
-        echo "   - Start Command: gunicorn --chdir backend app:app"
+        echo "   - Start Command: gunicorn --chdir backend --preload --worker-class gthread --threads 8 'app:create_app()'"
         echo "4. Set environment variables:"
         echo "   - MONGODB_URI: your_atlas_connection_string"
         echo "   - DATABASE_NAME: ai_attendance"
@@ -72,7 +72,7 @@ case $choice in
         echo "📦 Installation:"
         echo "1. pip install -r backend/requirements.txt"
         echo "2. Set environment variables"
-        echo "3. gunicorn --chdir backend app:app --bind 0.0.0.0:5000"
+        echo "3. gunicorn --chdir backend --preload --worker-class gthread --threads 8 'app:create_app()' --bind 0.0.0.0:5000"
         echo ""
         ;;
     *)